@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+PROTO = """<?xml version="1.0" encoding="utf-8"?>
+<xcb header="xproto">
+  <event name="MotionNotify" number="6">
+    <field type="BYTE" name="detail" />
+    <field type="CARD32" name="event" />
+    <field type="INT16" name="x" />
+    <field type="CARD16" name="state" />
+  </event>
+  <event name="Expose" number="12">
+    <pad bytes="1" />
+    <field type="CARD32" name="window" />
+    <field type="CARD16" name="x" />
+    <field type="CARD16" name="y" />
+    <field type="CARD16" name="width" />
+    <field type="CARD16" name="height" />
+    <field type="CARD16" name="count" />
+  </event>
+  <event name="DestroyNotify" number="17">
+    <pad bytes="1" />
+    <field type="CARD32" name="event" />
+    <field type="CARD32" name="window" />
+  </event>
+  <event name="PropertyNotify" number="28">
+    <pad bytes="1" />
+    <field type="CARD32" name="window" />
+    <field type="CARD32" name="atom" />
+  </event>
+</xcb>
+"""
+
+
+class TestQueue(unittest.TestCase):
+
+    def setUp(self):
+        from tilenol.xcb import Proto
+        from tilenol.xcb.coalesce import EventQueue
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'xproto.xml'), 'wt') as f:
+            f.write(PROTO)
+        proto = Proto(self.dir)
+        proto.load_xml('xproto')
+        self.events = {name: ev.type for name, ev
+                       in proto.subprotos['xproto'].events.items()}
+        self.queue = EventQueue()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def drain(self):
+        res = []
+        while self.queue:
+            res.append(self.queue.popleft())
+        return res
+
+    def testMotion(self):
+        mot = self.events['MotionNotify']
+        self.queue.append(mot(1, detail=0, event=10, x=1, state=0))
+        self.queue.append(mot(2, detail=0, event=10, x=2, state=0))
+        self.queue.append(mot(3, detail=0, event=11, x=3, state=0))
+        self.queue.append(mot(4, detail=0, event=11, x=4, state=0))
+        self.queue.append(mot(5, detail=0, event=11, x=5, state=256))
+        self.assertEqual([ev.x for ev in self.drain()], [2, 4, 5])
+        self.assertEqual(self.queue.folded['MotionNotify'], 2)
+
+    def testProperty(self):
+        prop = self.events['PropertyNotify']
+        self.queue.append(prop(1, window=10, atom=1))
+        self.queue.append(prop(2, window=10, atom=2))
+        self.queue.append(prop(3, window=10, atom=1))
+        self.assertEqual([ev.seq for ev in self.drain()], [1, 2])
+        self.queue.append(prop(4, window=10, atom=1))
+        self.assertEqual([ev.seq for ev in self.drain()], [4])
+        self.assertEqual(self.queue.folded['PropertyNotify'], 1)
+
+    def testExpose(self):
+        exp = self.events['Expose']
+        self.queue.append(exp(1, window=10, x=0, y=0, width=10, height=10,
+                              count=2))
+        self.queue.append(exp(1, window=11, x=0, y=0, width=5, height=5,
+                              count=0))
+        self.queue.append(exp(1, window=10, x=20, y=5, width=10, height=10,
+                              count=1))
+        self.queue.append(exp(1, window=10, x=5, y=30, width=1, height=1,
+                              count=0))
+        ev1, ev2 = self.drain()
+        self.assertEqual((ev1.window, ev1.width), (11, 5))
+        self.assertEqual((ev2.window, ev2.x, ev2.y, ev2.width, ev2.height),
+                         (10, 0, 0, 30, 31))
+        self.assertEqual(self.queue.folded['Expose'], 2)
+
+    def testRules(self):
+        mot = self.events['MotionNotify']
+        self.queue.set_rules(['Expose'])
+        self.queue.append(mot(1, detail=0, event=10, x=1, state=0))
+        self.queue.append(mot(2, detail=0, event=10, x=2, state=0))
+        self.assertEqual(len(self.drain()), 2)
+        with self.assertRaises(ValueError):
+            self.queue.set_rules(['KeyPress'])
+
+    def testPriority(self):
+        exp = self.events['Expose']
+        prop = self.events['PropertyNotify']
+        mot = self.events['MotionNotify']
+        self.queue.append(exp(1, window=10, x=0, y=0, width=10, height=10,
+                              count=0))
+        self.queue.append(prop(2, window=10, atom=1))
+        self.assertFalse(self.queue.input_pending())
+        self.queue.append(mot(3, detail=0, event=10, x=1, state=0))
+        self.assertTrue(self.queue.input_pending())
+        self.assertEqual([ev.seq for ev in self.drain()], [3, 2, 1])
+
+    def testBarrier(self):
+        exp = self.events['Expose']
+        dest = self.events['DestroyNotify']
+        mot = self.events['MotionNotify']
+        self.queue.append(exp(1, window=10, x=0, y=0, width=10, height=10,
+                              count=0))
+        self.queue.append(mot(2, detail=0, event=10, x=1, state=0))
+        self.queue.append(dest(3, event=10, window=10))
+        self.queue.append(exp(4, window=11, x=0, y=0, width=10, height=10,
+                              count=0))
+        self.queue.append(mot(5, detail=0, event=11, x=1, state=0))
+        self.assertTrue(self.queue.input_pending())
+        self.assertEqual(len(self.queue), 5)
+        self.assertEqual([ev.seq for ev in self.drain()], [2, 1, 3, 5, 4])
+        self.assertFalse(self.queue.input_pending())
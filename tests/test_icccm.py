@@ -0,0 +1,31 @@
+import unittest
+
+
+class TestHints(unittest.TestCase):
+
+    def testWMHints(self):
+        from tilenol.icccm import WMHints, InputHint, UrgencyHint
+        hints = WMHints.from_property([InputHint | UrgencyHint, 0, 1])
+        self.assertIs(hints.input, False)
+        self.assertIsNone(hints.initial_state)
+        self.assertTrue(hints.has_input)
+        self.assertTrue(hints.urgent)
+        hints = WMHints.from_property([0])
+        self.assertIsNone(hints.input)
+        self.assertFalse(hints.has_input)
+        self.assertFalse(hints.urgent)
+
+    def testShortSizeHints(self):
+        from tilenol.icccm import SizeHints, PMinSize, PBaseSize
+        typ = type('Atom', (), {'name': 'WM_SIZE_HINTS'})
+        arr = [PMinSize | PBaseSize, 0, 0, 0, 0, 100, 50] + [0]*8
+        hints = SizeHints.from_property(typ, arr)
+        self.assertEqual((hints.min_width, hints.min_height), (100, 50))
+        self.assertEqual((hints.base_width, hints.base_height), (0, 0))
+
+    def testWMClass(self):
+        from tilenol.icccm import get_wm_class
+        win = type('Window', (), {'props': {'WM_CLASS': 'xterm\0XTerm\0'}})
+        self.assertEqual(get_wm_class(win), ('xterm', 'XTerm'))
+        win.props = {}
+        self.assertEqual(get_wm_class(win), ())
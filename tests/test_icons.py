@@ -0,0 +1,43 @@
+import unittest
+
+
+class TestIcons(unittest.TestCase):
+
+    def testParse(self):
+        from tilenol.icons import pixels, parse_icons
+        data = pixels([2, 2, 1, 2, 3, 4, 1, 1, 5, 3, 3, 6])
+        self.assertEqual(parse_icons(data), [(1, 1, 8), (2, 2, 2)])
+
+    def testShared(self):
+        from tilenol.icons import icon_set
+        icons = icon_set((1, 1, 0x80ff0000))
+        self.assertIs(icon_set([1, 1, 0x80ff0000]), icons)
+        self.assertIsNot(icon_set((1, 1, 0x80ff0001)), icons)
+        self.assertFalse(icon_set(()))
+
+    def testPremultiply(self):
+        import struct
+        from tilenol.icons import pixels, premultiply
+        surf = premultiply(pixels([0x80ff4000]), 1, 1)
+        px, = struct.unpack('=L', bytes(surf.get_data())[:4])
+        self.assertEqual(px >> 24, 0x80)
+        self.assertEqual((px >> 16) & 0xff, 0x80)
+        self.assertEqual((px >> 8) & 0xff, 0x20)
+        self.assertEqual(px & 0xff, 0)
+
+    def testCache(self):
+        import gc
+        from tilenol.icons import icon_set, IconCache
+        cache = IconCache(limit=2*16*16*4)
+        icons = icon_set((2, 2) + (0xff000000,)*4)
+        surf = cache.get(icons, 16)
+        self.assertEqual((surf.get_width(), surf.get_height()), (16, 16))
+        self.assertIs(cache.get(icons, 16), surf)
+        cache.get(icons, 15)
+        cache.get(icons, 14)
+        self.assertEqual(cache.stats()['surfaces'], 2)
+        self.assertEqual(cache.evicted, 1)
+        del icons, surf
+        gc.collect()
+        self.assertEqual(cache.stats()['surfaces'], 0)
+        self.assertEqual(cache.total_bytes, 0)
@@ -0,0 +1,138 @@
+import unittest
+
+
+class Window(object):
+
+    def __init__(self, values):
+        from tilenol.properties import Properties
+        self.values = values
+        self.fetched = []
+        self.props = Properties(self)
+
+    def fetch_property(self, atom):
+        self.fetched.append(atom)
+        if atom in self.values:
+            self.props[atom] = self.values[atom]
+
+
+class TestProperties(unittest.TestCase):
+
+    def testLazy(self):
+        win = Window({'_NET_WM_ICON': 'icon'})
+        win.props.defer('_NET_WM_ICON', '_NET_WM_ICON')
+        win.props.defer('WM_GONE', 'WM_GONE')
+        self.assertIn('_NET_WM_ICON', win.props)
+        self.assertEqual(win.fetched, [])
+        self.assertEqual(win.props.get('_NET_WM_ICON'), 'icon')
+        self.assertEqual(win.props['_NET_WM_ICON'], 'icon')
+        self.assertEqual(win.fetched, ['_NET_WM_ICON'])
+        self.assertIsNone(win.props.get('WM_GONE'))
+        self.assertNotIn('WM_GONE', win.props)
+        self.assertIsNone(win.props.get('WM_NAME'))
+        self.assertEqual(win.fetched, ['_NET_WM_ICON', 'WM_GONE'])
+
+    def testDefer(self):
+        win = Window({'WM_NAME': 'title'})
+        self.assertFalse(win.props.defer('WM_NAME', 'WM_NAME'))
+        win.props.get('WM_NAME')
+        self.assertTrue(win.props.defer('WM_NAME', 'WM_NAME'))
+
+    def testFetching(self):
+        win = Window({'WM_NAME': 'old'})
+        win.props.defer('WM_NAME', 'WM_NAME')
+        entry = win.props.pending['WM_NAME']
+        # as if another reader looks while the reply is not received yet
+        self.assertIn('WM_NAME', win.props)
+        win.fetch_property('WM_NAME')
+        self.assertEqual(win.props.fetched('WM_NAME', entry), 'old')
+        self.assertEqual(win.props.pending, {})
+        self.assertEqual(win.props['WM_NAME'], 'old')
+
+    def testChangedWhileFetching(self):
+        win = Window({'WM_NAME': 'old'})
+        win.props.defer('WM_NAME', 'WM_NAME')
+        entry = win.props.pending['WM_NAME']
+        win.props.defer('WM_NAME', 'WM_NAME')
+        win.fetch_property('WM_NAME')
+        self.assertEqual(win.props.fetched('WM_NAME', entry), 'old')
+        win.values['WM_NAME'] = 'new'
+        self.assertEqual(win.props['WM_NAME'], 'new')
+
+    def testEager(self):
+        from tilenol.properties import want, is_eager
+        want('WM_TEST_EAGER')
+        self.assertTrue(is_eager('WM_TEST_EAGER'))
+        self.assertTrue(is_eager('WM_HINTS'))
+        self.assertTrue(is_eager('_TN_LP_GROUP'))
+        self.assertFalse(is_eager('WM_TEST_LAZY'))
+
+
+class Atom(int):
+    name = 'WM_TEST'
+
+
+class Atoms(object):
+    STRING = Atom(31)
+    UTF8_STRING = Atom(300)
+
+    def __getitem__(self, value):
+        return Atom(value)
+
+
+class TestReader(unittest.TestCase):
+
+    def setUp(self):
+        import struct
+        from tilenol.xcb.core import Core
+        self.core = Core.__new__(Core)
+        self.core.atom = Atoms()
+        self.core._get_property_part = self.part
+        self.core.property_head = 100
+        self.core.property_chunk = 40
+        self.data = struct.pack('<250L', *range(250))
+        self.type = 6
+        self.requests = []
+
+    def part(self, win, name, offset, length, async_=True):
+        self.requests.append((offset, length))
+        value = self.data[offset*4:(offset + length)*4]
+        return {
+            'type': self.type,
+            'format': 32,
+            'bytes_after': max(0, len(self.data) - offset*4 - len(value)),
+            'value': value,
+            }
+
+    def read(self):
+        first = self.core._get_property_part(1, 2, 0,
+                                             self.core.property_head)
+        return self.core._decode_property(1, 2, first)[1]
+
+    def testSmall(self):
+        self.data = self.data[:40]
+        self.assertEqual(list(self.read()), list(range(10)))
+        self.assertEqual(self.requests, [(0, 100)])
+
+    def testChunks(self):
+        self.assertEqual(list(self.read()), list(range(250)))
+        self.assertEqual(self.requests,
+                         [(0, 100), (100, 40), (140, 40), (180, 40),
+                          (220, 30)])
+
+    def testLimit(self):
+        self.core.max_property_bytes = 130*4 + 3
+        self.assertEqual(list(self.read()), list(range(130)))
+        self.assertEqual(self.requests, [(0, 100), (100, 30)])
+
+    def testLimitBelowHead(self):
+        self.core.max_property_bytes = 10*4
+        self.assertEqual(list(self.read()), list(range(10)))
+        self.assertEqual(self.requests, [(0, 100)])
+
+    def testChanged(self):
+        first = self.core._get_property_part(1, 2, 0,
+                                             self.core.property_head)
+        self.type = 7
+        value = self.core._decode_property(1, 2, first)[1]
+        self.assertEqual(list(value), list(range(100)))
+        self.assertEqual(self.requests, [(0, 100), (100, 40)])
@@ -0,0 +1,55 @@
+import unittest
+
+
+class TestScheduler(unittest.TestCase):
+
+    def paint(self, interval, count=3):
+        from zorro import Hub, sleep
+        from tilenol.render import RenderScheduler
+        painted = []
+        sched = RenderScheduler(interval)
+        hub = Hub()
+        @hub.run
+        def test():
+            for i in range(count):
+                sched.dirty(lambda i=i: painted.append(i))
+                sleep(0.01)
+        return sched, painted
+
+    def testPacing(self):
+        sched, painted = self.paint(0.05)
+        self.assertEqual(painted, [0, 1, 2])
+        self.assertEqual(sched.frames, 2)
+
+    def testZeroInterval(self):
+        sched, painted = self.paint(0)
+        self.assertEqual(painted, [0, 1, 2])
+        self.assertEqual(sched.frames, 3)
+        self.assertEqual(sched.stats()['skipped_frames'], 0)
+
+    def testNegativeInterval(self):
+        sched, painted = self.paint(-1)
+        self.assertEqual(painted, [0, 1, 2])
+        self.assertEqual(sched.frames, 3)
+        self.assertEqual(sched.stats()['skipped_frames'], 0)
+
+    def testDeferred(self):
+        from zorro import Hub, sleep
+        from tilenol.render import RenderScheduler
+        painted = []
+        pending = [True]
+        sched = RenderScheduler(0, lambda: pending[0])
+        hub = Hub()
+        @hub.run
+        def test():
+            sched.dirty(lambda: painted.append(1))
+            sleep(0.01)
+            self.assertEqual(painted, [])
+            sched.run_deferred()
+            sleep(0.01)
+            self.assertEqual(painted, [])
+            pending[0] = False
+            sched.run_deferred()
+            sleep(0.01)
+        self.assertEqual(painted, [1])
+        self.assertEqual(sched.deferred_frames, 1)
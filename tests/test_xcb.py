@@ -62,6 +62,15 @@ class TestConn(unittest.TestCase):
         self.assertTrue(xid2 > xid1)
         self.assertTrue(isinstance(xid1, int))
 
+    @xcbtest('xproto')
+    def testXidReuse(self, conn):
+        conn.connection()
+        xid = conn.new_xid()
+        conn.free_xid(xid)
+        self.assertNotEqual(conn.new_xid(), xid)
+        conn.do_request(conn.proto.requests['GetInputFocus'])
+        self.assertEqual(conn.new_xid(), xid)
+
 
 class TestWrapper(unittest.TestCase):
 
@@ -0,0 +1,191 @@
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+
+
+PROTO = """<?xml version="1.0" encoding="utf-8"?>
+<xcb header="xproto">
+  <xidtype name="WINDOW" />
+  <typedef oldname="CARD32" newname="TIMESTAMP" />
+  <struct name="POINT">
+    <field type="INT16" name="x" />
+    <field type="INT16" name="y" />
+  </struct>
+  <event name="Motion" number="6">
+    <field type="BYTE" name="detail" />
+    <field type="TIMESTAMP" name="time" />
+    <field type="WINDOW" name="event" />
+    <field type="INT16" name="x" />
+    <field type="INT16" name="y" />
+    <pad bytes="16" />
+  </event>
+  <event name="Var" number="7">
+    <field type="BYTE" name="detail" />
+    <field type="CARD16" name="num" />
+    <list type="CARD8" name="data">
+      <fieldref>num</fieldref>
+    </list>
+    <field type="CARD16" name="after" />
+    <field type="CARD32" name="last" />
+  </event>
+  <request name="QueryTree" opcode="15">
+    <pad bytes="1" />
+    <field type="WINDOW" name="window" />
+    <reply>
+      <pad bytes="1" />
+      <field type="WINDOW" name="root" />
+      <field type="CARD16" name="children_len" />
+      <pad bytes="14" />
+      <list type="WINDOW" name="children">
+        <fieldref>children_len</fieldref>
+      </list>
+    </reply>
+  </request>
+  <request name="InternAtom" opcode="16">
+    <field type="BOOL" name="only_if_exists" />
+    <field type="CARD16" name="name_len" />
+    <pad bytes="2" />
+    <list type="char" name="name">
+      <fieldref>name_len</fieldref>
+    </list>
+  </request>
+  <request name="AttachFd" opcode="6">
+    <field type="CARD32" name="shmseg" />
+    <fd name="shm_fd" />
+    <field type="BOOL" name="read_only" />
+    <pad bytes="3" />
+  </request>
+</xcb>
+"""
+
+
+class TestCodec(unittest.TestCase):
+
+    def setUp(self):
+        from tilenol.xcb import Proto
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'xproto.xml'), 'wt') as f:
+            f.write(PROTO)
+        self.proto = Proto(self.dir)
+        self.proto.load_xml('xproto')
+        self.xproto = self.proto.subprotos['xproto']
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testReply(self):
+        reply = self.xproto.requests['QueryTree'].reply
+        buf = (b'\x01\x00' + struct.pack('<LH14x', 0x100, 3)
+               + struct.pack('<3L', 7, 8, 9))
+        val, pos = reply.read_from(buf, 1)
+        self.assertEqual(pos, len(buf))
+        self.assertEqual(val['root'], 0x100)
+        self.assertEqual(list(val['children']), [7, 8, 9])
+
+    def testEvent(self):
+        ev = self.xproto.events['Motion']
+        buf = b'\x06\x01' + struct.pack('<HLLhh16x', 77, 1000, 0x200, -5, 10)
+        event = ev.type.from_packet(77, buf)
+        self.assertIs(event._buf, buf)
+        self.assertEqual(event.__class__.__name__, 'MotionEvent')
+        self.assertEqual(event.seq, 77)
+        self.assertEqual(event.detail, 1)
+        self.assertEqual(event.time, 1000)
+        self.assertEqual(event.event, 0x200)
+        self.assertEqual((event.x, event.y), (-5, 10))
+
+    def testEventAfterList(self):
+        ev = self.xproto.events['Var']
+        buf = b'\x07\x01' + struct.pack('<HH3BHL', 77, 3, 1, 2, 3, 500, 9)
+        buf += bytes(32 - len(buf))
+        event = ev.type.from_packet(77, buf)
+        self.assertEqual((event.detail, event.num), (1, 3))
+        self.assertEqual(list(event.data), [1, 2, 3])
+        self.assertEqual((event.after, event.last), (500, 9))
+
+    def testMakeEvent(self):
+        ev = self.xproto.events['Motion']
+        event = ev.type(5, 1, time=1000, event=0x200, x=-5, y=10)
+        self.assertEqual(bytes(event._buf), b'\x06\x01'
+            + struct.pack('<HLLhh16x', 5, 1000, 0x200, -5, 10))
+        self.assertEqual((event.detail, event.x), (1, -5))
+        self.assertEqual(repr(event), 'MotionEvent(seq=5, detail=1, '
+            'time=1000, event=512, x=-5, y=10)')
+
+    def testWrite(self):
+        buf = bytearray()
+        self.xproto.requests['InternAtom'].write_to(buf, {
+            'only_if_exists': True,
+            'name_len': 4,
+            'name': 'ATOM',
+            })
+        self.assertEqual(bytes(buf), b'\x01\x04\x00\x00\x00ATOM')
+
+    def testPayload(self):
+        from tilenol.xcb.codec import OutBuffer
+        buf = OutBuffer()
+        name = b'A' * OutBuffer.PAYLOAD_MIN
+        self.xproto.requests['InternAtom'].write_to(buf, {
+            'only_if_exists': True,
+            'name_len': len(name),
+            'name': name,
+            })
+        self.assertEqual(bytes(buf), b'\x01\x00\x10\x00\x00')
+        self.assertEqual(buf.size, 5 + len(name))
+        self.assertEqual(b''.join(buf.segments(1)), bytes(buf)[1:] + name)
+
+    def testFd(self):
+        from tilenol.xcb.codec import OutBuffer
+        buf = OutBuffer()
+        self.xproto.requests['AttachFd'].write_to(buf, {
+            'shmseg': 7,
+            'shm_fd': 13,
+            'read_only': True,
+            })
+        self.assertEqual(bytes(buf), b'\x07\x00\x00\x00\x01\x00\x00\x00')
+        self.assertEqual(buf.fds, [13])
+
+    def testWrongValue(self):
+        with self.assertRaisesRegex(ValueError, 'name_len'):
+            self.xproto.requests['InternAtom'].write_to(bytearray(), {
+                'only_if_exists': True,
+                'name_len': -1,
+                'name': 'ATOM',
+                })
+
+    def testCache(self):
+        from tilenol.xcb import Proto
+        cache = os.path.join(self.dir, 'c')
+        Proto(self.dir, cache_dir=cache).load_cached('xproto')
+        self.assertEqual(len(os.listdir(cache)), 1)
+        with open(os.path.join(cache, os.listdir(cache)[0]), 'rb') as f:
+            self.assertNotIn(b'marshal', f.read())  # no bytecode in cache
+        proto = Proto(self.dir, cache_dir=cache)
+        proto.load_xml = None  # must not be parsed again
+        proto.load_cached('xproto')
+        xproto = proto.subprotos['xproto']
+        self.assertIs(xproto.parent, proto)
+        self.assertEqual(xproto.events_by_num[6].name, 'Motion')
+        reply = xproto.requests['QueryTree'].reply
+        buf = (b'\x01\x00' + struct.pack('<LH14x', 0x100, 2)
+               + struct.pack('<2L', 7, 8))
+        val, pos = reply.read_from(buf, 1)
+        self.assertEqual(list(val['children']), [7, 8])
+
+    def testSetLength(self):
+        reply = self.xproto.requests['QueryTree'].reply
+        buf = (b'\x01\x00' + struct.pack('<LH14x', 0x100, 2)
+               + struct.pack('<2L', 7, 8))
+        self.assertEqual(len(reply.read_from(buf, 1)[0]['children']), 2)
+        reply.set_length('children', '1')
+        self.assertEqual(list(reply.read_from(buf, 1)[0]['children']), [7])
+
+    def testStructList(self):
+        from tilenol.xcb.xmlparse import Length, List
+        lst = List(Length('num'), self.xproto.types['POINT'])
+        val, pos = lst.rich_read_from(struct.pack('<4h', 1, -2, 3, 4), 0,
+                                      {'num': 2})
+        self.assertEqual(pos, 8)
+        self.assertEqual(val, [{'x': 1, 'y': -2}, {'x': 3, 'y': 4}])
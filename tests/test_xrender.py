@@ -0,0 +1,131 @@
+import struct
+import unittest
+
+
+class TestGlyphs(unittest.TestCase):
+
+    def testCommands(self):
+        from tilenol.xcb.xrender import glyph_commands, GLYPHS_PER_ITEM
+        buf = glyph_commands(10, 20, [1, 2, 3])
+        self.assertEqual(bytes(buf), struct.pack('<B3xhh3L', 3, 10, 20,
+                                                 1, 2, 3))
+        ids = list(range(GLYPHS_PER_ITEM + 1))
+        buf = glyph_commands(5, 6, ids)
+        self.assertEqual(len(buf), 8*2 + 4*len(ids))
+        second = 8 + 4*GLYPHS_PER_ITEM
+        self.assertEqual(struct.unpack_from('<B3xhhL', buf, second),
+                         (1, 0, 0, GLYPHS_PER_ITEM))
+
+    def testColor(self):
+        from tilenol.xcb.xrender import color16
+        self.assertEqual(color16(0xff8000), {
+            'red': 0xffff, 'green': 0x8080, 'blue': 0, 'alpha': 0xffff})
+
+
+class Recorder(object):
+    """Records requests, returns ``replies`` by request name"""
+
+    def __init__(self, **replies):
+        self.calls = []
+        self.replies = replies
+
+    def __getattr__(self, name):
+        def request(*args, **kw):
+            self.calls.append((name, args, kw))
+            return self.replies.get(name)
+        return request
+
+
+class FakeCore(object):
+
+    def __init__(self):
+        self.render = Recorder(QueryPictFormats={
+            'formats': [{'id': 1, 'depth': 8, 'type': 1,
+                         'direct': {'alpha_mask': 0xff}}],
+            'screens': [{'depths': [{'visuals': [
+                {'visual': 33, 'format': 2}]}]}],
+            })
+        self.root = {'root_visual': 33}
+        self.xid = 100
+
+    def new_xid(self):
+        self.xid += 1
+        return self.xid
+
+
+class FakeGlyphs(object):
+    gsid = 7
+
+    def glyphs(self, text):
+        return [ord(c) for c in text]
+
+    def width(self, ids):
+        return 5*len(ids)
+
+
+class TestDisplayList(unittest.TestCase):
+
+    def testReplay(self):
+        from tilenol.xcb.xrender import Renderer, pack_rectangles
+        from tilenol.xcb.xrender import glyph_commands, color16
+        core = FakeCore()
+        rnd = Renderer(core)
+        self.assertEqual((rnd.a8_format, rnd.root_format), (1, 2))
+        font = type('Font', (), {'face': 'sans', 'size': 10})
+        rnd._glyphsets['sans', 10] = FakeGlyphs()
+        dl = rnd.display_list()
+        dl.fill(0xff0000, 1, 2, 3, 4)
+        self.assertEqual(dl.text_width(font, 'ab'), 10)
+        self.assertEqual(dl.text(font, 0xffffff, 5.5, 6, 'ab'), 10)
+        dl.text(font, 0xffffff, 0, 0, '')
+        del core.render.calls[:]
+        dl.replay(50)
+        self.assertEqual(core.render.calls, [
+            ('FillRectangles', (), {'op': 1, 'dst': 50,
+                                'color': color16(0xff0000),
+                                'rects': pack_rectangles([(1, 2, 3, 4)])}),
+            ('CreateSolidFill', (), {'picture': 101,
+                                 'color': color16(0xffffff)}),
+            ('CompositeGlyphs32', (), {'op': 3, 'src': 101, 'dst': 50,
+                                   'mask_format': 0, 'glyphset': 7,
+                                   'src_x': 0, 'src_y': 0,
+                                   'glyphcmds': glyph_commands(5, 6,
+                                                               [97, 98])}),
+            ])
+
+
+class TestBar(unittest.TestCase):
+
+    def testCompositeServer(self):
+        import tilenol.ewmh  # imports tilenol.window in the right order
+        from tilenol.widgets.bar import Bar, Cached
+        from tilenol.xcb import Rectangle
+        calls = []
+        commands = Recorder()
+        bar = Bar.__new__(Bar)
+        bar.renderer = Recorder()
+        bar.theme = type('Theme', (), {
+            'bar': type('BarTheme', (), {'background': 0x101010})})
+        bar.img = Recorder()
+        bar.picture = 5
+        bar.pixmap = 6
+        bar.width, bar.height = 100, 20
+        bar._composite = lambda x1, x2: calls.append((x1, x2))
+        bar._cache = [
+            Cached(None, 0, 100, 30, 100, 0, 30, None, commands),
+            Cached(None, 30, 100, 60, 100, 30, 30, object(), None),
+            Cached(None, 60, 100, 100, 100, 60, 40, None, commands),
+            Cached(None, 100, 100, 100, 100, 0, 0, None, None),
+            ]
+        bar._composite_server(20, 70)
+        self.assertEqual(bar.renderer.calls, [
+            ('clip', (5, (20, 0, 50, 20)), {}),
+            ('fill', (5, 0x101010, [(20, 0, 50, 20)]), {}),
+            ('clip', (5, (20, 0, 10, 20)), {}),
+            ('clip', (5, (60, 0, 10, 20)), {}),
+            ('clip', (5, (0, 0, 100, 20)), {}),
+            ])
+        self.assertEqual(calls, [(30, 60)])
+        self.assertEqual(bar.img.calls, [
+            ('draw', (6,), {'rect': Rectangle(30, 0, 30, 20)})])
+        self.assertEqual(commands.calls, [('replay', (5,), {})] * 2)
@@ -1,6 +1,8 @@
 from zorro.di import di
 
 from .ewmh import match_type
+from .icccm import get_wm_class
+from .properties import want
 
 
 class Classifier(object):
@@ -23,17 +25,15 @@ class Classifier(object):
             if all(cond(win) for cond in conditions):
                 for act in actions:
                     act(win)
-        for klass in self._split_class(win.props.get('WM_CLASS', '')):
+        for klass in self._split_class(get_wm_class(win)):
             for conditions, actions in self.class_rules.get(klass, ''):
                 if all(cond(win) for cond in conditions):
                     for act in actions:
                         act(win)
 
     @staticmethod
-    def _split_class(cls):
-        for name in cls.split('\0'):
-            if not name:
-                continue
+    def _split_class(names):
+        for name in names:
             yield name
             while '-' in name:
                 name, _ = name.rsplit('-', 1)
@@ -49,6 +49,7 @@ def match_role(*roles):
 
 
 def has_property(*properties):
+    want(*properties)
     def checker(win):
         for prop in properties:
             if prop in win.props:
@@ -77,6 +78,7 @@ def ignore_protocols(*ignore):
 
 
 def move_to_group_of(prop):
+    want(prop)
     def setter(win):
         wid = win.props[prop][0]
         other = di(win)['event-dispatcher'].all_windows[wid]
@@ -74,6 +74,14 @@ class Config(object):
 
         config.setdefault('auto-screen-configuration', True)
         config.setdefault('screen-dpi', 96)
+        config.setdefault('error-provenance', 'sampled')
+        config.setdefault('coalesce-events',
+                          ['MotionNotify', 'PropertyNotify', 'Expose'])
+        config.setdefault('event-timing', False)
+        config.setdefault('frame-interval', 0.03)
+        config.setdefault('shm-pool-size', 16)
+        config.setdefault('icon-cache-size', 4096)
+        config.setdefault('max-property-size', 4096)
 
         self.data = config
 
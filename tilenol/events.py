@@ -1,3 +1,4 @@
+import time
 import struct
 import logging
 
@@ -10,6 +11,7 @@ from .xcb import Core, Rectangle, XError
 from .groups import GroupManager
 from .commands import CommandDispatcher
 from .classify import Classifier
+from .icccm import get_wm_hints
 from .screen import ScreenManager
 from .event import Event
 from .config import Config
@@ -19,6 +21,59 @@ from . import randr
 log = logging.getLogger(__name__)
 
 
+class HandlerSlot(object):
+    """Handlers of a single event type
+
+    The ``handler`` is called for every event unless there is a handler
+    for the window of the event in ``windows``
+    """
+
+    def __init__(self, name, handler, window_field):
+        self.name = name
+        self.handler = handler
+        self.window_field = window_field
+        self.windows = {}
+
+    def dispatch(self, ev):
+        if self.windows:
+            handler = self.windows.get(getattr(ev, self.window_field),
+                                       self.handler)
+        else:
+            handler = self.handler
+        if handler is None:
+            log.warning("Unknown event ``%r''", ev)
+        else:
+            handler(ev)
+
+
+class TimedHandlerSlot(HandlerSlot):
+    """Handler slot which measures time spent in handlers"""
+
+    def __init__(self, name, handler, window_field):
+        super().__init__(name, handler, window_field)
+        self.calls = 0
+        self.total_time = 0
+        self.max_time = 0
+
+    def dispatch(self, ev):
+        start = time.perf_counter()
+        try:
+            super().dispatch(ev)
+        finally:
+            spent = time.perf_counter() - start
+            self.calls += 1
+            self.total_time += spent
+            if spent > self.max_time:
+                self.max_time = spent
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'total_time': self.total_time,
+            'max_time': self.max_time,
+            }
+
+
 @has_dependencies
 class EventDispatcher(object):
 
@@ -38,12 +93,64 @@ class EventDispatcher(object):
         self.mapping_notify = Event('mapping_notify')
         self.mapping_notify.listen(self._mapping_notify_delayed)
 
+    def __zorro_di_done__(self):
+        slot_class = (TimedHandlerSlot if self.config['event-timing']
+                      else HandlerSlot)
+        self.slots = {}
+        self.slots_by_name = {}
+        self.unknown_slot = HandlerSlot('Unknown', None, None)
+        for code, etype in self.xcore.event_types().items():
+            fields = etype.type._fields
+            if 'window' in fields:
+                wfield = 'window'
+            elif 'event' in fields:
+                wfield = 'event'
+            else:
+                wfield = None
+            slot = self.slots_by_name.get(etype.name)
+            if slot is None:
+                slot = slot_class(etype.name,
+                    getattr(self, 'handle_' + etype.name + 'Event', None),
+                    wfield)
+                self.slots_by_name[etype.name] = slot
+            self.slots[code] = slot
+
     def dispatch(self, ev):
-        meth = getattr(self, 'handle_'+ev.__class__.__name__, None)
-        if meth:
-            meth(ev)
+        self.slots.get(ev.code, self.unknown_slot).dispatch(ev)
+
+    def stats(self):
+        """Time spent in handlers by event type (with ``event-timing``)"""
+        return {name: slot.stats()
+                for name, slot in self.slots_by_name.items()
+                if isinstance(slot, TimedHandlerSlot) and slot.calls}
+
+    def cmd_stats(self):
+        if not self.config['event-timing']:
+            log.info("Event timing is disabled, see ``event-timing``")
+            return
+        for name, st in sorted(self.stats().items(),
+                               key=lambda pair: -pair[1]['total_time']):
+            log.info("Event %s: calls: %d, total: %.3fs, max: %.1fms",
+                     name, st['calls'], st['total_time'],
+                     st['max_time'] * 1000)
+
+    def add_handler(self, event_name, handler, window=None):
+        """Sets handler for events of the type, optionally for single window
+
+        Window handler replaces the default one for the window, and is
+        removed when the window is destroyed.
+        """
+        slot = self.slots_by_name[event_name]
+        if window is None:
+            slot.handler = handler
+        elif slot.window_field is None:
+            raise ValueError("Event {!r} has no window".format(event_name))
         else:
-            log.warning("Unknown event ``%r''", ev)
+            slot.windows[int(window)] = handler
+
+    def remove_window_handlers(self, window):
+        for slot in self.slots_by_name.values():
+            slot.windows.pop(window, None)
 
     def register_window(self, win):
         self.all_windows[win.wid] = win
@@ -97,8 +204,8 @@ class EventDispatcher(object):
                     win.pointer_enter()
             if self.active_field:
                 return
-            if(win.props.get("WM_HINTS") is None
-                or win.props.get('WM_HINTS')[0] & 1):
+            hints = get_wm_hints(win)
+            if hints is None or hints.has_input:
                 win.focus()
 
     def handle_LeaveNotifyEvent(self, ev):
@@ -193,10 +300,11 @@ class EventDispatcher(object):
         self.windows[win.wid] = win
         self.all_windows[win.wid] = win
         try:
-            for name in self.xcore.raw.ListProperties(window=win)['atoms']:
-                win.update_property(name)
+            atoms = self.xcore.raw.ListProperties(window=win)['atoms']
         except XError:
             log.warning("Window destroyed immediately %d", win.wid)
+        else:
+            win.update_properties(atoms)
 
     def handle_ConfigureNotifyEvent(self, ev):
         pass
@@ -205,6 +313,8 @@ class EventDispatcher(object):
         pass
 
     def handle_DestroyNotifyEvent(self, ev):
+        self.xcore.free_xid(ev.window)
+        self.remove_window_handlers(ev.window)
         try:
             win = self.all_windows.pop(ev.window)
         except KeyError:
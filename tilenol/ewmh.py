@@ -53,13 +53,18 @@ def match_type(*types):
     types = tuple('_NET_WM_WINDOW_TYPE_' + typ.upper() for typ in types)
     assert all(typ.isidentifier() for typ in types)
     def type_checker(win):
+        wtypes = get_window_types(win)
         for typ in types:
-            rtype = getattr(win.xcore.atom, typ)
-            if rtype in win.props.get('_NET_WM_WINDOW_TYPE', ()):
+            if getattr(win.xcore.atom, typ) in wtypes:
                 return True
     return type_checker
 
 
+def get_window_types(win):
+    """Returns atoms of ``_NET_WM_WINDOW_TYPE``, the preferred one first"""
+    return win.props.get('_NET_WM_WINDOW_TYPE') or ()
+
+
 def get_title(win):
     return (win.props.get('_NET_WM_VISIBLE_NAME')
             or win.props.get('_NET_WM_NAME')
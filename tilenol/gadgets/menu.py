@@ -12,8 +12,10 @@ from tilenol.commands import CommandDispatcher
 from tilenol.window import DisplayWindow
 from tilenol.events import EventDispatcher
 from tilenol.event import Event
+from tilenol.render import RenderScheduler
 from tilenol.config import Config
 from tilenol.ewmh import get_title
+from tilenol.icccm import get_wm_class
 
 
 @has_dependencies
@@ -21,12 +23,11 @@ class Select(GadgetBase):
 
     commander = dependency(CommandDispatcher, 'commander')
     dispatcher = dependency(EventDispatcher, 'event-dispatcher')
+    render = dependency(RenderScheduler, 'render-scheduler')
 
     def __init__(self, max_lines=10):
         self.window = None
         self.max_lines = max_lines
-        self.redraw = Event('menu.redraw')
-        self.redraw.listen(self._redraw)
         self.submit_ev = Event('menu.submit')
         self.submit_ev.listen(self._submit)
         self.complete = Event('menu.complete')
@@ -60,12 +61,14 @@ class Select(GadgetBase):
             })
         self.window = di(self).inject(DisplayWindow(wid, self.draw,
             focus_out=self._close))
-        self.dispatcher.all_windows[wid] = self.window
-        self.dispatcher.frames[wid] = self.window  # dirty hack
+        self.dispatcher.register_window(self.window)
+        # focus is managed by menu itself, so ignore pointer crossing
+        self.dispatcher.add_handler('EnterNotify', self._ignore, window=wid)
+        self.dispatcher.add_handler('LeaveNotify', self._ignore, window=wid)
         self.window.show()
         self.window.focus()
         self.text_field = di(self).inject(TextField(self.theme.menu, events={
-            'draw': self.redraw,
+            'draw': self.render.painter(self._redraw),
             'submit': self.submit_ev,
             'complete': self.complete,
             'close': self.close,
@@ -76,8 +79,11 @@ class Select(GadgetBase):
     def cmd_hide(self):
         self._close()
 
+    def _ignore(self, ev):
+        pass
+
     def draw(self, rect=None):
-        self._img.draw(self.window)
+        self._img.draw(self.window, rect=rect)
 
     def match_lines(self, value):
         matched = set()
@@ -115,6 +121,7 @@ class Select(GadgetBase):
             # don't need to render, need resize
             self.height = newh
             bounds = self.commander['screen'].bounds._replace(height=newh)
+            self._img.release()
             self._img = self.xcore.pixbuf(bounds.width, newh)
             self.window.set_bounds(bounds)
         ctx = self._img.context()
@@ -147,6 +154,8 @@ class Select(GadgetBase):
         if self.window:
             self.window.destroy()
             self.window = None
+            self._img.release()
+            self._img = None
         if self.dispatcher.active_field == self.text_field:
             self.dispatcher.active_field = None
         self.text_field = None
@@ -156,7 +165,7 @@ class Select(GadgetBase):
         self.text_field.value = text
         self.text_field.sel_start = len(text)
         self.text_field.sel_width = 0
-        self.redraw.emit()
+        self.render.dirty(self._redraw)
 
 
 class SelectExecutable(Select):
@@ -214,7 +223,7 @@ class FindWindow(Select):
             for win in g.all_windows:
                 t = (get_title(win)
                     or win.props.get('WM_ICON_NAME')
-                    or win.props.get('WM_CLASS'))
+                    or ' '.join(get_wm_class(win)))
                 items.append((t, win))
         return sorted(items, key=itemgetter(0))
 
@@ -234,7 +243,7 @@ class RenameWindow(Select):
             win.props.get("_NET_WM_NAME"),
             win.props.get("WM_NAME"),
             win.props.get("WM_ICON_NAME"),
-            win.props.get("WM_CLASS").replace('\0', ' '),
+            ' '.join(get_wm_class(win)),
             win.props.get("WM_WINDOW_ROLE"),
             ]
         res = []
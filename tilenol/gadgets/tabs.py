@@ -5,10 +5,10 @@ from tilenol.events import EventDispatcher
 from tilenol.ewmh import get_title
 from tilenol.xcb import Core as XCore, Rectangle
 from tilenol.commands import CommandDispatcher
-from tilenol.event import Event
+from tilenol.render import RenderScheduler
 from tilenol.theme import Theme
-from tilenol.window import DisplayWindow, Window
-from tilenol.icccm import is_window_urgent
+from tilenol.window import DisplayWindow, Window, prefetch_properties
+from tilenol.icccm import is_window_urgent, get_wm_class
 from .base import GadgetBase
 
 from zorro.di import di, has_dependencies, dependency
@@ -39,6 +39,8 @@ class State(object):
         cur = self.commander.get('window')
         gr = self._group
         subs = list(gr.current_layout.sublayouts())
+        prefetch_properties([win for sec in subs for win in sec.windows]
+                            + list(gr.floating_windows), '_NET_WM_ICON')
         res = []
         for sec in subs:
             wins = sec.windows
@@ -56,7 +58,7 @@ class State(object):
 
     def _winstate(self, win, cur):
         return WindowState(
-            title=get_title(win) or win.props.get("WM_CLASS") or hex(win),
+            title=get_title(win) or ' '.join(get_wm_class(win)) or hex(win),
             icon=getattr(win, 'icons', None),
             active=win is cur,
             urgent=is_window_urgent(win),
@@ -75,16 +77,13 @@ class LeftBar(object):
     theme = dependency(Theme, 'theme')
     dispatcher = dependency(EventDispatcher, 'event-dispatcher')
     commander = dependency(CommandDispatcher, 'commander')
+    render = dependency(RenderScheduler, 'render-scheduler')
 
     def __init__(self, screen, width, groups, states):
         self.screen = screen
         self.width = width
         self._cairo = None
         self._img = None
-        self.redraw = Event('leftbar.redraw')
-        self.redraw.listen(self._redraw)
-        self.repaint = Event('leftbar.repaint')
-        self.repaint.listen(self._paint)
         self.screen.add_group_hook(self._group_hook)
         self.visible = False
         self.groups = groups
@@ -108,18 +107,24 @@ class LeftBar(object):
         Window.any_window_changed.listen(self._check_redraw)
 
     def paint(self, rect):
-        self.repaint.emit()
+        if self._img:
+            self._img.draw(self.window, rect=rect)
 
     def _check_redraw(self):
         st  = self.states.get(self.screen.group)
         if st is None or st.dirty:
-            self.redraw.emit()
+            self.render.dirty(self._redraw)
 
     def set_bounds(self, rect):
         self.bounds = rect
         self.window.set_bounds(rect)
+        self._drop_image()
+
+    def _drop_image(self):
         self._cairo = None
-        self._img = None
+        if self._img is not None:
+            self._img.release()
+            self._img = None
 
     def _draw_section(self, title, y):
         ctx = self._cairo
@@ -210,7 +215,7 @@ class LeftBar(object):
                 else:
                     y = self._draw_win(win, y)
         self._drawn_group = gr
-        self.repaint.emit()
+        self._paint()
 
     def _group_hook(self):
         ngr = self.screen.group
@@ -218,7 +223,7 @@ class LeftBar(object):
             self.show()
         else:
             self.hide()
-        self.redraw.emit()
+        self.render.dirty(self._redraw)
 
     def show(self):
         if not self.visible:
@@ -231,8 +236,7 @@ class LeftBar(object):
             self.visible = False
             self.screen.unslice_left(self)
             self.window.hide()
-            self._cairo = None
-            self._img = None
+            self._drop_image()
 
 
 @has_dependencies
@@ -2,6 +2,7 @@ from itertools import chain
 
 from zorro.di import has_dependencies, dependency, di
 
+from .xcb import Core
 from .screen import ScreenManager
 from .event import Event
 from .icccm import is_window_urgent
@@ -12,6 +13,7 @@ from .config import Config
 @has_dependencies
 class GroupManager(object):
 
+    xcore = dependency(Core, 'xcore')
     screenman = dependency(ScreenManager, 'screen-manager')
     commander = dependency(CommandDispatcher, 'commander')
 
@@ -71,6 +73,14 @@ class GroupManager(object):
         ogr = self.commander['group']
         if ngr is ogr:
             return
+        with self.xcore.batch():
+            self._switch(ogr, ngr)
+        self.commander['group'] = ngr
+        self.commander['layout'] = ngr.current_layout
+        self.commander['screen'] = ngr.screen
+        self.group_changed.emit()
+
+    def _switch(self, ogr, ngr):
         if ngr in self.current_groups.values():
             ogr.screen, ngr.screen = ngr.screen, ogr.screen
             self.current_groups[ngr.screen] = ngr
@@ -82,10 +92,6 @@ class GroupManager(object):
             self.current_groups[s] = ngr
             ngr.screen = s
             ngr.show()
-        self.commander['group'] = ngr
-        self.commander['layout'] = ngr.current_layout
-        self.commander['screen'] = ngr.screen
-        self.group_changed.emit()
 
     def cmd_switch_next(self):
         ogr = self.commander['group']
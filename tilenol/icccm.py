@@ -37,6 +37,8 @@ class SizeHints(object):
     @classmethod
     def from_property(self, type, arr):
         assert type.name == 'WM_SIZE_HINTS'
+        # old clients send 15 values, without base size and gravity
+        arr = tuple(arr) + (0,) * (18 - len(arr))
         flags = arr[0]
         hints = SizeHints()
         if flags & PMinSize:
@@ -59,16 +61,59 @@ class SizeHints(object):
         return hints
 
 
+class WMHints(object):
+    """Decoded ``WM_HINTS``, fields not set by ``flags`` are ``None``"""
+
+    __slots__ = ('flags', 'input', 'initial_state', 'window_group')
+
+    def __init__(self, flags=0, input=None, initial_state=None,
+                 window_group=None):
+        self.flags = flags
+        self.input = input
+        self.initial_state = initial_state
+        self.window_group = window_group
+
+    @classmethod
+    def from_property(cls, arr):
+        arr = tuple(arr) + (0,) * (9 - len(arr))
+        flags = arr[0]
+        return cls(flags,
+            input=bool(arr[1]) if flags & InputHint else None,
+            initial_state=arr[2] if flags & StateHint else None,
+            window_group=arr[8] if flags & WindowGroupHint else None)
+
+    @property
+    def urgent(self):
+        return bool(self.flags & UrgencyHint)
+
+    @property
+    def has_input(self):
+        """The input field is set, i.e. window says if it wants focus"""
+        return bool(self.flags & InputHint)
+
+
+def get_wm_hints(win):
+    """Returns ``WMHints`` of the window or None if there are no hints"""
+    value = win.props.get('WM_HINTS')
+    if not value:
+        return None
+    return WMHints.from_property(value)
+
+
+def get_wm_class(win):
+    """Returns tuple of instance and class names, without empty ones"""
+    value = win.props.get('WM_CLASS')
+    if not value:
+        return ()
+    return tuple(name for name in value.split('\0') if name)
+
+
 def is_window_urgent(win):
-    hints = win.props.get('WM_HINTS')
-    if hints is None:
-        return False
-    return bool(hints[0] & UrgencyHint)
+    hints = get_wm_hints(win)
+    return hints is not None and hints.urgent
 
 
 def is_window_needs_input(win):
-    hints = win.props.get('WM_HINTS')
-    if hints is None:
-        return False
-    return bool(hints[0] & InputHint)
+    hints = get_wm_hints(win)
+    return hints is not None and hints.has_input
 
@@ -0,0 +1,196 @@
+"""Decoding of the ``_NET_WM_ICON`` property
+
+The property is a number of images, each one is width, height and then
+width*height of ARGB pixels which are not premultiplied. Only headers of
+images are parsed when the property changes, pixels are converted when the
+image is drawn first time. Windows having equal icons share single
+``IconSet`` (e.g. all the terminals).
+
+Images scaled to the size they are drawn at are kept in the ``IconCache``
+until the icon set is not used by any window any more.
+"""
+import sys
+import array
+import hashlib
+import logging
+import weakref
+from math import ceil
+from collections import OrderedDict
+
+import cairo
+
+
+log = logging.getLogger(__name__)
+
+ALPHA_BYTE = 3 if sys.byteorder == 'little' else 0
+
+_icon_sets = weakref.WeakValueDictionary()
+
+
+def pixels(value):
+    """Converts property value to the array of 32bit integers"""
+    if isinstance(value, array.array) and value.itemsize == 4:
+        return value
+    data = array.array('I', value)
+    assert data.itemsize == 4
+    return data
+
+
+def parse_icons(data):
+    """Returns sorted list of (width, height, offset) of images in data"""
+    images = []
+    pos = 0
+    end = len(data)
+    while end - pos >= 2:
+        w, h = data[pos], data[pos+1]
+        pos += 2
+        if end - pos < w*h:
+            log.warning("Invalid icon %dx%d but got %d pixels",
+                        w, h, end - pos)
+            break
+        if w and h:
+            images.append((w, h, pos))
+        pos += w*h
+    images.sort()
+    return images
+
+
+def premultiply(data, width, height):
+    """Returns ARGB32 surface made of non-premultiplied pixels
+
+    Multiplication is done by cairo, by painting colors through the mask
+    made of alpha channel, so there is no python code per pixel
+    """
+    raw = memoryview(data).cast('B')
+    color = cairo.ImageSurface.create_for_data(raw,
+        cairo.FORMAT_RGB24, width, height, width*4)
+    alpha = raw[ALPHA_BYTE::4].tobytes()
+    stride = cairo.ImageSurface.format_stride_for_width(
+        cairo.FORMAT_A8, width)
+    if stride != width:
+        pad = bytes(stride - width)
+        alpha = b''.join(alpha[i:i+width] + pad
+                         for i in range(0, len(alpha), width))
+    mask = cairo.ImageSurface.create_for_data(bytearray(alpha),
+        cairo.FORMAT_A8, width, height, stride)
+    surf = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    ctx = cairo.Context(surf)
+    ctx.set_operator(cairo.OPERATOR_SOURCE)
+    ctx.set_source_surface(color)
+    ctx.mask_surface(mask)
+    surf.flush()
+    return surf
+
+
+class IconSet(object):
+    """Images of the icon of different sizes, decoded on demand"""
+
+    def __init__(self, data, key):
+        self.data = data
+        self.key = key
+        self.images = parse_icons(data)
+
+    def __bool__(self):
+        return bool(self.images)
+
+    def best(self, size):
+        """Smallest image not less than ``size``, or the largest one"""
+        for img in self.images:
+            if img[0] >= size or img[1] >= size:
+                break
+        return img
+
+    def scaled(self, size):
+        """Returns premultiplied surface of the icon scaled to ``size``"""
+        w, h, offset = self.best(size)
+        src = premultiply(self.data[offset:offset + w*h], w, h)
+        if w == h == size:
+            return src
+        side = int(ceil(size))
+        surf = cairo.ImageSurface(cairo.FORMAT_ARGB32, side, side)
+        ctx = cairo.Context(surf)
+        scale = min(w/size, h/size)
+        pat = cairo.SurfacePattern(src)
+        pat.set_matrix(cairo.Matrix(xx=scale, yy=scale))
+        pat.set_filter(cairo.FILTER_BEST)
+        ctx.set_source(pat)
+        ctx.paint()
+        surf.flush()
+        return surf
+
+
+class IconCache(object):
+    """Icons scaled to the size they are drawn at
+
+    Least recently used surfaces are dropped when their total size exceeds
+    ``limit`` bytes. Surfaces of the icon set are dropped as soon as the
+    set is garbage collected, i.e. when windows change their icons.
+    """
+
+    def __init__(self, limit=4 << 20):
+        self.limit = limit
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._surfaces = OrderedDict()
+        self._sets = set()
+
+    def get(self, icons, size):
+        key = icons.key, size
+        surf = self._surfaces.get(key)
+        if surf is not None:
+            self._surfaces.move_to_end(key)
+            self.hits += 1
+            return surf
+        self.misses += 1
+        surf = self._surfaces[key] = icons.scaled(size)
+        self.total_bytes += surf.get_stride() * surf.get_height()
+        if icons.key not in self._sets:
+            self._sets.add(icons.key)
+            weakref.finalize(icons, self.forget, icons.key)
+        self._trim()
+        return surf
+
+    def _drop(self, key):
+        surf = self._surfaces.pop(key)
+        self.total_bytes -= surf.get_stride() * surf.get_height()
+
+    def _trim(self):
+        while self.total_bytes > self.limit and len(self._surfaces) > 1:
+            self._drop(next(iter(self._surfaces)))
+            self.evicted += 1
+
+    def forget(self, set_key):
+        """Drops all surfaces of the icon set"""
+        self._sets.discard(set_key)
+        for key in [k for k in self._surfaces if k[0] == set_key]:
+            self._drop(key)
+
+    def clear(self):
+        self._surfaces.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {
+            'surfaces': len(self._surfaces),
+            'icon_sets': len(self._sets),
+            'total_bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evicted': self.evicted,
+            }
+
+    def cmd_stats(self):
+        log.info("Icon cache: %s", ', '.join('{}: {}'.format(k, v)
+                 for k, v in sorted(self.stats().items())))
+
+
+def icon_set(value):
+    """Returns ``IconSet`` of the property value, equal icons are shared"""
+    data = pixels(value)
+    key = hashlib.sha1(data).digest()
+    icons = _icon_sets.get(key)
+    if icons is None:
+        icons = _icon_sets[key] = IconSet(data, key)
+    return icons
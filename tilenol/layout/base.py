@@ -3,6 +3,7 @@ from collections import OrderedDict
 from zorro.di import di, has_dependencies, dependency
 
 from tilenol.event import Event
+from tilenol.xcb import Core
 
 
 class LayoutMeta(type):
@@ -18,6 +19,8 @@ class LayoutMeta(type):
 @has_dependencies
 class Layout(metaclass=LayoutMeta):
 
+    xcore = dependency(Core, 'xcore')
+
     def __init__(self):
         self.visible = False
         self.relayout = Event('layout.relayout')
@@ -25,8 +28,9 @@ class Layout(metaclass=LayoutMeta):
 
     def check_relayout(self):
         if self.visible:
-            self.layout()
-            self.group.check_focus()
+            with self.xcore.batch():
+                self.layout()
+                self.group.check_focus()
 
     @classmethod
     def get_defined_classes(cls, base):
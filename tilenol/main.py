@@ -10,6 +10,7 @@ from zorro import gethub
 from zorro import dns
 
 from .xcb import Connection, Proto, Core, Keysyms, Rectangle, XError
+from .render import RenderScheduler
 from .keyregistry import KeyRegistry
 from .mouseregistry import MouseRegistry
 from .ewmh import Ewmh
@@ -21,6 +22,7 @@ from .groups import Group, GroupManager
 from .screen import ScreenManager
 from .classify import Classifier
 from .theme import Theme
+from .icons import IconCache
 from . import randr
 from .gestures import Gestures
 
@@ -62,6 +64,7 @@ class Tilenol(object):
     dispatcher = dependency(EventDispatcher, 'event-dispatcher')
     config = dependency(Config, 'config')
     commander = dependency(CommandDispatcher, 'commander')
+    render = dependency(RenderScheduler, 'render-scheduler')
 
     def __init__(self, options):
         pass
@@ -79,11 +82,8 @@ class Tilenol(object):
         signal.signal(signal.SIGQUIT, quit_handler)
 
         proto = Proto()
-        proto.load_xml('xproto')
-        proto.load_xml('xtest')
-        proto.load_xml('xinerama')
-        proto.load_xml('shm')
-        proto.load_xml('randr')
+        proto.load_cached('xproto', 'xtest', 'xinerama', 'shm', 'randr',
+                          'xc_misc', 'bigreq', 'render')
         self.conn = conn = Connection(proto)
         conn.connection()
         self.root_window = Root(conn.init_data['roots'][0]['root'])
@@ -98,10 +98,18 @@ class Tilenol(object):
 
         cfg = inj['config'] = inj.inject(Config())
         cfg.init_extensions()
+        conn.set_error_provenance(cfg['error-provenance'])
+        conn.events.set_rules(cfg['coalesce-events'])
+        inj['render-scheduler'] = RenderScheduler(cfg['frame-interval'],
+                                                  conn.events.input_pending)
+        if xcore.shm_pool is not None:
+            xcore.shm_pool.limit = cfg['shm-pool-size'] << 20
+        inj['icon-cache'] = IconCache(cfg['icon-cache-size'] << 10)
+        xcore.max_property_bytes = cfg['max-property-size'] << 10
 
         # Hack, but this only makes GetScreenInfo work
-        xcore.randr._proto.requests['GetScreenInfo'].reply.items['rates'].code\
-            = compile('0', 'XPROTO', 'eval')
+        xcore.randr._proto.requests['GetScreenInfo'].reply.set_length(
+            'rates', '0')
         if cfg['auto-screen-configuration']:
             if randr.check_screens(xcore):
                 randr.configure_outputs(xcore, cfg['screen-dpi']/25.4)
@@ -147,12 +155,17 @@ class Tilenol(object):
         eman = inj.inject(EventDispatcher())
         eman.all_windows[self.root_window.wid] = self.root_window
         inj['event-dispatcher'] = eman
+        cmd['events'] = eman
         inj['ewmh'] = Ewmh()
         inj.inject(inj['ewmh'])
 
         inj.inject(self)
 
         cmd['env'] = EnvCommands()
+        if xcore.shm_pool is not None:
+            cmd['shm'] = xcore.shm_pool
+        cmd['icons'] = inj['icon-cache']
+        cmd['render'] = inj['render-scheduler']
         cmd['emul'] = inj.inject(EmulCommands())
 
         # Register hotkeys as mapping notify can be skipped on inplace restart
@@ -171,7 +184,7 @@ class Tilenol(object):
                 else:
                     scr.add_top_bar(bar)
                 bar.create_window()
-                scr.updated.listen(bar.redraw.emit)
+                scr.updated.listen(bar.dirty)
 
         self.register_gadgets()
 
@@ -181,16 +194,22 @@ class Tilenol(object):
     def catch_windows(self):
         cnotify = self.xcore.proto.events['CreateNotify'].type
         mnotify = self.xcore.proto.events['MapRequest'].type
+        raw = self.xcore.raw.async_
+        replies = []
         for w in self.xcore.raw.QueryTree(window=self.root_window)['children']:
             if w == self.root_window or w in self.dispatcher.all_windows:
                 continue
+            replies.append((w,
+                raw.GetWindowAttributes(window=w),
+                raw.GetGeometry(drawable=w)))
+        for w, attr, geom in replies:
             try:
-                attr = self.xcore.raw.GetWindowAttributes(window=w)
+                attr = attr.get()
+                geom = geom.get()
             except XError:  # TODO(pc) check for error code
                 continue
             if attr['class'] == self.xcore.WindowClass.InputOnly:
                 continue
-            geom = self.xcore.raw.GetGeometry(drawable=w)
             self.dispatcher.handle_CreateNotifyEvent(cnotify(0,
                 window=w,
                 parent=self.root_window.wid,
@@ -230,6 +249,7 @@ class Tilenol(object):
                 self.dispatcher.dispatch(i)
             except Exception:
                 log.exception("Error handling event %r", i)
+            self.render.run_deferred()
 
     def cmd_restart(self):
         inplace_restart()
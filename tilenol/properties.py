@@ -0,0 +1,100 @@
+"""Properties of client windows
+
+Only properties which tilenol reads are fetched when the window is created
+and when they change. They are listed in ``EAGER``, names used in the
+configuration (i.e. by classifier rules) are added with ``want()``.
+Everything else (i.e. big ``_NET_WM_ICON``) is fetched on first access to
+``Window.props``.
+"""
+
+EAGER = {
+    # ICCCM
+    'WM_NAME',
+    'WM_ICON_NAME',
+    'WM_CLASS',
+    'WM_WINDOW_ROLE',
+    'WM_HINTS',
+    'WM_NORMAL_HINTS',
+    'WM_PROTOCOLS',
+    # EWMH
+    '_NET_WM_NAME',
+    '_NET_WM_VISIBLE_NAME',
+    '_NET_WM_WINDOW_TYPE',
+    '_NET_WM_DESKTOP',  # the group of the window
+    }
+EAGER_PREFIXES = ('_TN_LP_',)
+_MISSING = object()
+
+
+def want(*names):
+    """Declares properties which are fetched as soon as they change"""
+    EAGER.update(names)
+
+
+def is_eager(name):
+    return name in EAGER or name.startswith(EAGER_PREFIXES)
+
+
+class Pending(object):
+    """Property which is changed but not fetched yet"""
+    __slots__ = ('atom',)
+
+    def __init__(self, atom):
+        self.atom = atom
+
+
+class Properties(dict):
+    """Properties of the window, which fetches lazy properties on access
+
+    The ``pending`` maps names to ``Pending`` properties which are set on
+    the window but not fetched yet. Property stays pending while it's being
+    fetched, so it's not missing for other readers in the meantime.
+    """
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self.pending = {}
+
+    def __missing__(self, name):
+        entry = self.pending.get(name)
+        if entry is None:
+            raise KeyError(name)
+        self.window.fetch_property(entry.atom)
+        value = self.fetched(name, entry)
+        if value is _MISSING:
+            raise KeyError(name)
+        return value
+
+    def fetched(self, name, entry):
+        """Marks ``entry`` of ``pending`` as fetched and stored
+
+        Returns the value (``_MISSING`` if fetching failed). If property
+        changed again while it was being fetched, the value isn't kept, so
+        the new one is fetched on the next access.
+        """
+        value = super().get(name, _MISSING)
+        current = self.pending.get(name)
+        if current is entry:
+            del self.pending[name]
+        elif current is not None:
+            super().pop(name, None)
+        return value
+
+    def __contains__(self, name):
+        return super().__contains__(name) or name in self.pending
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def defer(self, name, atom):
+        """Marks property to be fetched on access
+
+        Returns True if the property was fetched before, so somebody might
+        be interested in the change
+        """
+        self.pending[name] = Pending(atom)
+        return self.pop(name, _MISSING) is not _MISSING
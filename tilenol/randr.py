@@ -3,7 +3,7 @@ import pprint
 import struct
 
 from zorro import Hub
-from tilenol.xcb import Connection, Proto
+from tilenol.xcb import Connection, Proto, gather
 from tilenol.xcb.core import Core
 
 
@@ -133,17 +133,16 @@ def print_output_properties(core):
 def check_screens(core):
     scr = core.randr.GetScreenResources(window=core.root_window)
     allmapped = set()
-    for crtc in scr['crtcs']:
-        cinfo = core.randr.GetCrtcInfo(
+    for cinfo in gather([core.randr.async_.GetCrtcInfo(
             crtc=crtc,
             config_timestamp=scr['config_timestamp'],
-            )
+            ) for crtc in scr['crtcs']]):
         allmapped.update(cinfo['outputs'])
-    for oid in scr['outputs']:
-        oinfo = core.randr.GetOutputInfo(
+    outputs = gather([core.randr.async_.GetOutputInfo(
             output=oid,
             config_timestamp=scr['config_timestamp'],
-            )
+            ) for oid in scr['outputs']])
+    for oid, oinfo in zip(scr['outputs'], outputs):
         oname = bytes(oinfo['name']).decode('utf-8')
         if oinfo['connection'] == 0 and oid not in allmapped:
             print("CONNECTED", oname)
@@ -165,19 +164,21 @@ def configure_outputs(core, ppm=3.78):
         mm_width = 0
         mm_height = 0
         crtc_index = 0
-        for idx, oid in enumerate(scr['outputs']):
-            oinfo = core.randr.GetOutputInfo(
+        outputs = gather([core.randr.async_.GetOutputInfo(
                 output=oid,
                 config_timestamp=scr['config_timestamp'],
-                )
+                ) for oid in scr['outputs']])
+        nconnected = sum(oinfo['connection'] == 0 for oinfo in outputs)
+        crtcs = gather([core.randr.async_.GetCrtcInfo(
+                crtc=crtc,
+                config_timestamp=scr['config_timestamp'],
+                ) for crtc in scr['crtcs'][:nconnected]])
+        for idx, (oid, oinfo) in enumerate(zip(scr['outputs'], outputs)):
             oname = bytes(oinfo['name']).decode('utf-8')
             if oinfo['connection'] == 0:
                 crtc = scr['crtcs'][crtc_index]
+                cinfo = crtcs[crtc_index]
                 crtc_index += 1
-                cinfo = core.randr.GetCrtcInfo(
-                    crtc=crtc,
-                    config_timestamp=scr['config_timestamp'],
-                    )
                 mid = oinfo['modes'][0]
                 updates.append(dict(
                     crtc=crtc,
@@ -284,12 +285,10 @@ def main():
     def main():
         nonlocal retcode
         proto = Proto()
-        proto.load_xml('xproto')
-        proto.load_xml('randr')
-        proto.load_xml('xinerama')
+        proto.load_cached('xproto', 'randr', 'xinerama')
         core = Core(Connection(proto))
-        core.randr._proto.requests['GetScreenInfo'].reply.items['rates'].code \
-            = compile('0', 'XPROTO', 'eval')
+        core.randr._proto.requests['GetScreenInfo'].reply.set_length(
+            'rates', '0')
 
         if options.disable is not None:
             disable_output(core, options.disable)
@@ -0,0 +1,126 @@
+import time
+import logging
+from functools import partial
+from collections import OrderedDict
+
+from zorro import gethub, sleep
+
+from .event import Event
+
+
+log = logging.getLogger(__name__)
+
+
+class Painter(object):
+    """Marks painting function dirty on ``emit()``
+
+    May be used in place of ``Event`` where event is expected
+    """
+
+    def __init__(self, scheduler, fun):
+        self.scheduler = scheduler
+        self.fun = fun
+
+    def emit(self):
+        self.scheduler.dirty(self.fun)
+
+
+class RenderScheduler(object):
+    """Calls painting functions marked dirty, at most once per frame
+
+    Everything marked dirty in the interval between frames is painted at
+    the next frame, so few changes of the bar in a row are painted once.
+    Zero ``interval`` disables pacing.
+
+    Frames are cosmetic (see ``tilenol.xcb.coalesce``), so while
+    ``input_pending()`` returns true they are deferred until the main loop
+    calls ``run_deferred()``.
+    """
+
+    def __init__(self, interval=0.03, input_pending=None):
+        self.interval = interval
+        self.input_pending = input_pending
+        self.frame = Event('render.frame')
+        self.frame.listen(self._render)
+        self._dirty = OrderedDict()
+        self._timer = None
+        self._next_frame = 0
+        self._deferred = False
+        self.frames = 0
+        self.deferred_frames = 0
+        self.skipped_frames = 0
+        self.render_time = 0  # of the last frame
+        self.max_render_time = 0
+
+    def dirty(self, fun):
+        """Marks ``fun`` to be called on the next frame"""
+        self._dirty[fun] = None
+        if self._timer is None:
+            delay = self._next_frame - time.time()
+            if delay > 0:
+                self._timer = gethub().do_spawn(partial(self._wait, delay))
+            else:
+                self._start_frame()
+
+    def painter(self, fun):
+        return Painter(self, fun)
+
+    def _wait(self, delay):
+        try:
+            sleep(delay)
+        finally:
+            self._timer = None
+        self._start_frame()
+
+    def _start_frame(self):
+        if self.input_pending is not None and self.input_pending():
+            if not self._deferred:
+                self._deferred = True
+                self.deferred_frames += 1
+        else:
+            self.frame.emit()
+
+    def run_deferred(self):
+        """Starts the frame deferred because of input, if it's all handled
+        """
+        if self._deferred and not self.input_pending():
+            self._deferred = False
+            self.frame.emit()
+
+    def _render(self):
+        start = time.time()
+        painters = list(self._dirty)
+        self._dirty.clear()
+        for fun in painters:
+            try:
+                fun()
+            except Exception:
+                log.exception("Error painting %r", fun)
+        spent = time.time() - start
+        if self.interval > 0:
+            skipped = int(spent // self.interval)
+        else:  # no pacing, paint as soon as something is dirty
+            skipped = 0
+        self.frames += 1
+        self.render_time = spent
+        self.max_render_time = max(self.max_render_time, spent)
+        self.skipped_frames += skipped
+        log.debug("Frame %d: painted %d in %.1f ms, skipped %d frames",
+            self.frames, len(painters), spent*1000, skipped)
+        self._next_frame = start + self.interval*(skipped + 1)
+        if self._dirty and self._timer is None:  # marked while painting
+            self._timer = gethub().do_spawn(partial(self._wait,
+                max(0, self._next_frame - time.time())))
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'skipped_frames': self.skipped_frames,
+            'deferred_frames': self.deferred_frames,
+            'render_time': self.render_time,
+            'max_render_time': self.max_render_time,
+            }
+
+    def cmd_stats(self):
+        log.info("Render: %s", ', '.join('{}: {}'.format(k, v)
+                 for k, v in sorted(self.stats().items())))
@@ -1,4 +1,6 @@
-from math import ceil
+import logging
+from math import ceil, floor
+from collections import namedtuple
 
 import cairo
 from zorro.di import di, has_dependencies, dependency
@@ -6,30 +8,64 @@ from zorro.di import di, has_dependencies, dependency
 from tilenol.xcb import Core, Rectangle
 from tilenol.window import DisplayWindow
 from tilenol.events import EventDispatcher
-from tilenol.event import Event
 from tilenol.theme import Theme
+from tilenol.render import RenderScheduler
+
+
+log = logging.getLogger(__name__)
+
+
+Cached = namedtuple('Cached', ('key', 'left', 'right',
+    'new_left', 'new_right', 'x', 'width', 'surface', 'commands'))
+
+
+def widget_span(l, r, nl, nr):
+    """Returns horizontal span occupied by widget, given what it returned
+
+    Span is from ``l`` to ``nl`` for left-aligned widgets, from ``nr`` to
+    ``r`` for right-aligned ones, and everything for stretched ones
+    """
+    x1 = l if nl != l else nr
+    x2 = r if nr != r else nl
+    if x1 >= x2:
+        return None
+    return int(floor(x1)), int(ceil(x2))
 
 
 @has_dependencies
 class Bar(object):
 
+    BACKENDS = ('cairo', 'render')
+
     xcore = dependency(Core, 'xcore')
     dispatcher = dependency(EventDispatcher, 'event-dispatcher')
     theme = dependency(Theme, 'theme')
+    render = dependency(RenderScheduler, 'render-scheduler')
 
-
-    def __init__(self, widgets, position='top'):
+    def __init__(self, widgets, position='top', backend='cairo'):
         self.widgets = widgets
         self.position = position
+        if backend not in self.BACKENDS:
+            log.error("Unknown bar backend %r, must be one of %s,"
+                      " bar is drawn by cairo",
+                      backend, ', '.join(self.BACKENDS))
+            backend = 'cairo'
+        self.backend = backend
         self.bounds = None
         self.window = None
-        self.redraw = Event('bar.redraw')
-        self.redraw.listen(self.expose)
+        self.img = None
+        self.renderer = None
+        self.pixmap = None
+        self._cache = [None]*len(widgets)
 
     def __zorro_di_done__(self):
         bar = self.theme.bar
         self.height = bar.height
         self.background = bar.background_pat
+        if self.backend == 'render':
+            self.renderer = self.xcore.renderer
+            if self.renderer is None:
+                log.warning("No RENDER extension, bar is drawn by cairo")
         inj = di(self).clone()
         inj['bar'] = self
         for w in self.widgets:
@@ -40,10 +76,23 @@ class Bar(object):
         self.bounds = rect
         self.width = rect.width
         stride = self.xcore.bitmap_stride
+        if self.img is not None:
+            self.img.release()
         self.img = self.xcore.pixbuf(self.width, self.height)
         self.cairo = self.img.context()
+        self._cache = [None]*len(self.widgets)
+        if self.renderer is not None:
+            if self.pixmap is not None:
+                self.renderer.free_picture(self.picture)
+                self.xcore.free_pixmap(self.pixmap)
+            self.pixmap = self.xcore.create_pixmap(self.width, self.height)
+            self.picture = self.renderer.create_picture(self.pixmap)
         if self.window and not self.window.set_bounds(rect):
-            self.redraw.emit()
+            self.dirty()
+
+    def dirty(self):
+        """Marks bar to be redrawn on the next frame"""
+        self.render.dirty(self.redraw)
 
     def create_window(self):
         EM = self.xcore.EventMask
@@ -59,19 +108,134 @@ class Bar(object):
         self.dispatcher.register_window(self.window)
         self.window.show()
 
-    def expose(self, rect=None):
-        # TODO(tailhook) set clip region to specified rectangle
-        self.cairo.set_source(self.background)
-        self.cairo.rectangle(0, 0, self.width, self.height)
-        self.cairo.fill()
+    def expose(self, rect):
+        """Uploads exposed rectangle from the back buffer"""
+        if None in self._cache:  # not drawn yet
+            self.redraw()
+        else:
+            self._show(rect)
+
+    def redraw(self):
+        with self.xcore.batch():
+            damage = self._draw()
+            if damage:
+                x1, x2 = damage
+                self._show(Rectangle(x1, 0, x2 - x1, self.height))
+
+    def _show(self, rect):
+        if self.pixmap is None:
+            self.img.draw(self.window, rect=rect)
+        else:
+            self.xcore.raw.CopyArea(
+                src_drawable=self.pixmap,
+                dst_drawable=self.window,
+                gc=self.xcore.pixbuf_gc,
+                src_x=rect.x,
+                src_y=rect.y,
+                dst_x=rect.x,
+                dst_y=rect.y,
+                width=rect.width,
+                height=rect.height,
+                )
+
+    def _render(self, widget, key, l, r):
+        """Draws widget into its own surface (or display list)
+
+        Returns the cache entry for the widget
+        """
+        if self.renderer is not None and widget.draw_server is not None:
+            commands = self.renderer.display_list()
+            nl, nr = widget.draw_server(commands, l, r)
+            span = widget_span(l, r, nl, nr)
+            if span is None:
+                return Cached(key, l, r, nl, nr, 0, 0, None, None)
+            x1, x2 = span
+            return Cached(key, l, r, nl, nr, x1, x2 - x1, None, commands)
+        canvas = self.cairo
+        canvas.save()
+        canvas.rectangle(l, 0, r-l, self.height)
+        canvas.clip()
+        canvas.push_group()
+        nl, nr = widget.draw(canvas, l, r)
+        pat = canvas.pop_group()
+        canvas.restore()
+        span = widget_span(l, r, nl, nr)
+        if span is None:
+            return Cached(key, l, r, nl, nr, 0, 0, None, None)
+        x1, x2 = span
+        surf = cairo.ImageSurface(cairo.FORMAT_ARGB32, x2 - x1, self.height)
+        ctx = cairo.Context(surf)
+        ctx.translate(-x1, 0)
+        ctx.set_source(pat)
+        ctx.paint()
+        return Cached(key, l, r, nl, nr, x1, x2 - x1, surf, None)
+
+    def _draw(self):
+        """Redraws widgets which changed
+
+        Returns horizontal span of the bar which needs to be uploaded
+        """
+        full = None in self._cache
+        dx1, dx2 = self.width, 0
         l = 0
         r = self.width
-        for i in self.widgets:
-            self.cairo.save()
-            self.cairo.rectangle(l, 0, r-l, self.height)
-            self.cairo.clip()
-            l, r = i.draw(self.cairo, l, r)
-            self.cairo.restore()
-        self.img.draw(self.window)
+        for idx, widget in enumerate(self.widgets):
+            key = widget.key()
+            old = self._cache[idx]
+            if(old is not None and old.left == l and old.right == r
+               and key is not None and old.key == key):
+                l, r = old.new_left, old.new_right
+                continue
+            new = self._cache[idx] = self._render(widget, key, l, r)
+            for item in (old, new):
+                if item is not None and item.width:
+                    dx1 = min(dx1, item.x)
+                    dx2 = max(dx2, item.x + item.width)
+            l, r = new.new_left, new.new_right
+        if full:
+            dx1, dx2 = 0, self.width
+        if dx1 >= dx2:
+            return None
+        if self.pixmap is None:
+            self._composite(dx1, dx2)
+        else:
+            self._composite_server(dx1, dx2)
+        return dx1, dx2
+
+    def _composite(self, dx1, dx2):
+        canvas = self.cairo
+        canvas.save()
+        canvas.rectangle(dx1, 0, dx2 - dx1, self.height)
+        canvas.clip()
+        canvas.set_source(self.background)
+        canvas.paint()
+        for item in self._cache:
+            if(item.surface is not None and item.x < dx2
+               and item.x + item.width > dx1):
+                canvas.set_source_surface(item.surface, item.x, 0)
+                canvas.paint()
+        canvas.restore()
 
+    def _composite_server(self, dx1, dx2):
+        """Paints damaged span to the pixmap
 
+        Widgets drawn by cairo are composited over background to the image
+        and uploaded to the pixmap, display lists are replayed on the server
+        """
+        rnd = self.renderer
+        rect = dx1, 0, dx2 - dx1, self.height
+        rnd.clip(self.picture, rect)
+        rnd.fill(self.picture, self.theme.bar.background, [rect])
+        for item in self._cache:
+            if item.x >= dx2 or item.x + item.width <= dx1:
+                continue
+            x1 = max(item.x, dx1)
+            x2 = min(item.x + item.width, dx2)
+            if item.commands is not None:
+                rnd.clip(self.picture, (x1, 0, x2 - x1, self.height))
+                item.commands.replay(self.picture)
+            elif item.surface is not None:
+                self._composite(x1, x2)
+                self.img.draw(self.pixmap,
+                              rect=Rectangle(x1, 0, x2 - x1, self.height))
+        rnd.clip(self.picture, (0, 0, self.width, self.height))
@@ -1,4 +1,5 @@
 from abc import abstractmethod, ABCMeta
+from math import ceil
 from collections import namedtuple
 
 from cairo import SolidPattern
@@ -13,6 +14,10 @@ class Widget(metaclass=ABCMeta):
 
     bar = dependency(Bar, 'bar')
     stretched = False
+    # Widgets may implement ``draw_server(canvas, left, right)`` which
+    # is like ``draw`` but ``canvas`` is ``xrender.DisplayList``, to be
+    # drawn on the server by bars with ``backend: render``
+    draw_server = None
 
     def __init__(self, right=False):
         self.right = right
@@ -21,6 +26,30 @@ class Widget(metaclass=ABCMeta):
     def draw(self, canvas, left, right):
         return left, right
 
+    def key(self):
+        """Returns a value which changes when widget needs to be redrawn
+
+        Widget is also redrawn when it's moved. ``None`` means the widget
+        is redrawn every time bar is drawn
+        """
+        return None
+
+    def place(self, l, r, width):
+        """Places content ``width`` wide with ``padding`` around it
+
+        The content is put at the left edge of the space between ``l`` and
+        ``r``, or at the right one for right widgets. Returns origin of the
+        text (i.e. the baseline) and new ``l`` and ``r``
+        """
+        pad = self.padding
+        if self.right:
+            x = r - pad.right - width
+            r -= pad.left + pad.right + width
+        else:
+            x = l + pad.left
+            l += pad.left + pad.right + width
+        return (x, self.height - pad.bottom), l, r
+
 
 @has_dependencies
 class Sep(Widget):
@@ -33,6 +62,9 @@ class Sep(Widget):
         self.color = bar.separator_color_pat
         self.line_width = bar.separator_width
 
+    def key(self):
+        return ()
+
     def draw(self, canvas, l, r):
         if self.right:
             x = r - self.padding.right - 0.5
@@ -46,3 +78,12 @@ class Sep(Widget):
         canvas.line_to(x, self.height - self.padding.bottom)
         canvas.stroke()
         return l, r
+
+    def draw_server(self, canvas, l, r):
+        (x, _), l, r = self.place(l, r, 0)
+        if self.right:
+            x -= self.line_width
+        canvas.fill(self.theme.bar.separator_color, int(x), self.padding.top,
+                    int(ceil(self.line_width)),
+                    self.height - self.padding.top - self.padding.bottom)
+        return l, r
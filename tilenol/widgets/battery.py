@@ -118,6 +118,9 @@ class Battery(Widget):
         else:
             self.text = '--'
 
+    def key(self):
+        return self.text
+
     def draw(self, canvas, l, r):
         self.font.apply(canvas)
         canvas.set_source(self.color)
@@ -131,3 +134,9 @@ class Battery(Widget):
         canvas.move_to(x, self.height - self.padding.bottom)
         canvas.show_text(self.text)
         return l, r
+
+    def draw_server(self, canvas, l, r):
+        (x, y), l, r = self.place(l, r,
+                                  canvas.text_width(self.font, self.text))
+        canvas.text(self.font, self.theme.bar.text_color, x, y, self.text)
+        return l, r
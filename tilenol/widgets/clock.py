@@ -31,11 +31,14 @@ class Clock(Widget):
             if tts < 0.001:
                 tts = 1
             sleep(tts)
-            self.bar.redraw.emit()
+            self.bar.dirty()
 
     def _time(self):
         return datetime.datetime.now().strftime(self.format)
 
+    def key(self):
+        return self._time()
+
     def draw(self, canvas, l, r):
         self.font.apply(canvas)
         canvas.set_source(self.color)
@@ -50,3 +53,9 @@ class Clock(Widget):
         canvas.move_to(x, self.height - self.padding.bottom)
         canvas.show_text(tm)
         return l, r
+
+    def draw_server(self, canvas, l, r):
+        tm = self._time()
+        (x, y), l, r = self.place(l, r, canvas.text_width(self.font, tm))
+        canvas.text(self.font, self.theme.bar.text_color, x, y, tm)
+        return l, r
@@ -56,7 +56,10 @@ class Gesture(Widget):
                 self.state = (None, None, None, None)
             else:
                 self.state = st
-            self.bar.redraw.emit()
+            self.bar.dirty()
+
+    def key(self):
+        return self.state
 
     def draw(self, canvas, l, r):
         name, offset, state, cfg = self.state
@@ -36,7 +36,10 @@ class _Graph(Widget):
                 tts = 1
             sleep(tts)
             self.update()
-            self.bar.redraw.emit()
+            self.bar.dirty()
+
+    def key(self):
+        return tuple(self.values), self.maxvalue
 
     def draw(self, canvas, l, r):
         canvas.set_line_join(cairo.LINE_JOIN_ROUND)
@@ -78,7 +81,7 @@ class _Graph(Widget):
                 self.maxvalue = -min(self.values)
             else:
                 self.maxvalue = max(self.values)
-        self.bar.redraw.emit()
+        self.bar.dirty()
 
 
 class CPUGraph(_Graph):
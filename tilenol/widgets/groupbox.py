@@ -67,12 +67,15 @@ class Groupbox(Widget):
         self.subactive_color = bar.subactive_border_pat
         self.padding = bar.text_padding
         self.border_width = bar.border_width
-        self.state.gman.group_changed.listen(self.bar.redraw.emit)
+        self.state.gman.group_changed.listen(self.bar.dirty)
         Window.any_window_changed.listen(self.check_state)
 
     def check_state(self):
         if self.state.dirty:
-            self.bar.redraw.emit()
+            self.bar.dirty()
+
+    def key(self):
+        return self.state._read()
 
     def draw(self, canvas, l, r):
         self.state.update()
@@ -118,3 +121,35 @@ class Groupbox(Widget):
             canvas.show_text(gname)
             x += ax + between
         return x, r
+
+    def draw_server(self, canvas, l, r):
+        self.state.update()
+        assert not self.right, "Sorry, right not implemented"
+        bar = self.theme.bar
+        x = int(l)
+        for gs in self.state.groups:
+            gname = gs.name
+            if self.first_letter:
+                gname = gname[0]
+            (tx, ty), nx, r = self.place(x, r,
+                                         canvas.text_width(self.font, gname))
+            w = nx - x
+            if gs.active or gs.visible:
+                if gs.active:
+                    color = bar.active_border
+                else:
+                    color = bar.subactive_border
+                if self.filled:
+                    canvas.fill(color, x, 0, w, self.height)
+                else:
+                    canvas.frame(color, x + 2, 2, w - 4, self.height - 4,
+                                 self.border_width)
+            if gs.urgent:
+                color = bar.bright_color
+            elif gs.empty:
+                color = bar.dim_color
+            else:
+                color = bar.text_color
+            canvas.text(self.font, color, tx, ty, gname)
+            x = nx
+        return x, r
@@ -6,6 +6,7 @@ from .base import Widget
 from tilenol.commands import CommandDispatcher
 from tilenol.theme import Theme
 from tilenol.ewmh import get_title
+from tilenol.window import prefetch_properties
 
 
 @has_dependencies
@@ -26,12 +27,19 @@ class Title(Widget):
 
     def window_changed(self):
         if self.oldwin is not None:
-            self.oldwin.property_changed.unlisten(self.bar.redraw.emit)
+            self.oldwin.property_changed.unlisten(self.property_changed)
         win = self.dispatcher.get('window', None)
         if win is not None:
-            win.property_changed.listen(self.bar.redraw.emit)
+            win.property_changed.listen(self.property_changed)
         self.oldwin = win
-        self.bar.redraw.emit()
+        self.property_changed()
+
+    def property_changed(self):
+        self.bar.dirty()
+
+    def key(self):
+        win = self.dispatcher.get('window', None)
+        return win and get_title(win) or ''
 
     def draw(self, canvas, l, r):
         win = self.dispatcher.get('window', None)
@@ -44,6 +52,15 @@ class Title(Widget):
         canvas.show_text(get_title(win) or '')
         return r, r
 
+    def draw_server(self, canvas, l, r):
+        win = self.dispatcher.get('window', None)
+        if not win:
+            return r, r
+        (x, y), _, _ = self.place(l, r, 0)
+        canvas.text(self.font, self.theme.bar.text_color, x, y,
+                    get_title(win) or '')
+        return r, r
+
 
 @has_dependencies
 class Icon(Widget):
@@ -55,15 +72,28 @@ class Icon(Widget):
         self.padding = self.theme.bar.box_padding
         self.dispatcher.events['window'].listen(self.window_changed)
         self.oldwin = None
+        self.changes = 0  # of properties of the window
 
     def window_changed(self):
         if self.oldwin is not None:
-            self.oldwin.property_changed.unlisten(self.bar.redraw.emit)
+            self.oldwin.property_changed.unlisten(self.property_changed)
         win = self.dispatcher.get('window', None)
         if win is not None:
-            win.property_changed.listen(self.bar.redraw.emit)
+            win.property_changed.listen(self.property_changed)
         self.oldwin = win
-        self.bar.redraw.emit()
+        self.property_changed()
+
+    def property_changed(self):
+        # icon is fetched here, not in the middle of painting
+        if self.oldwin is not None:
+            prefetch_properties([self.oldwin], '_NET_WM_ICON')
+        self.changes += 1
+        self.bar.dirty()
+
+    def key(self):
+        # the icon itself isn't touched, not to fetch it while painting
+        win = self.dispatcher.get('window', None)
+        return win and win.wid, self.changes
 
     def draw(self, canvas, l, r):
         win = self.dispatcher.get('window', None)
@@ -73,7 +73,7 @@ class Systray(Widget):
             })
             self.icons.append(win)
             win.show()
-            self.bar.redraw.emit()
+            self.bar.dirty()
         elif op == 1:  # BEGIN_MESSAGE
             pass
         elif op == 2:  # CANCEL_MESSAGE
@@ -81,7 +81,10 @@ class Systray(Widget):
 
     def remove(self, icon):
         self.icons.remove(icon)
-        self.bar.redraw.emit()
+        self.bar.dirty()
+
+    def key(self):
+        return tuple(self.icons)
 
     def draw(self, canvas, l, r):
         l = int(l)
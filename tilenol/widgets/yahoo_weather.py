@@ -142,6 +142,9 @@ class YahooWeather(Widget):
                 data['{0}_{1}'.format(tag, attr)] = val
         return data
 
+    def key(self):
+        return self.text, self.image
+
     def draw(self, canvas, l, r):
         self.font.apply(canvas)
         _, _, w, h, _, _ = canvas.text_extents(self.text)
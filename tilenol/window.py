@@ -12,7 +12,10 @@ from .icccm import SizeHints, is_window_needs_input
 from .commands import CommandDispatcher
 from .ewmh import Ewmh
 from .event import Event
+from .render import RenderScheduler
 from .theme import Theme
+from .icons import icon_set, IconCache
+from .properties import Properties, is_eager
 
 
 log = logging.getLogger(__name__)
@@ -96,9 +99,11 @@ class Window(BaseWindow):
     xcore = dependency(Core, 'xcore')
     ewmh = dependency(Ewmh, 'ewmh')
     theme = dependency(Theme, 'theme')
+    icon_cache = dependency(IconCache, 'icon-cache')
 
     border_width = 0
     ignore_hints = False
+    _icons = None
     any_window_changed = Event('Window.any_window_changed')
 
     def __init__(self, wid):
@@ -113,7 +118,7 @@ class Window(BaseWindow):
         # Parameters that received from X server
         self.real = State()
 
-        self.props = {}
+        self.props = Properties(self)
         self.lprops = LayoutProperties(self)
         self.property_changed = Event('window.property_changed')
         self.protocols = set()
@@ -257,6 +262,40 @@ class Window(BaseWindow):
         return self.frame
 
     def update_property(self, atom):
+        name = self.xcore.atom[atom].name
+        if not is_eager(name):
+            if self.props.defer(name, atom):
+                self.property_changed.emit()
+                self.any_window_changed.emit()
+            return
+        try:
+            self._set_property(name, *self.xcore.get_property(self, atom))
+        except XError:
+            log.debug("Error getting property for window %r", self)
+        else:
+            self.property_changed.emit()
+            self.any_window_changed.emit()
+
+    def update_properties(self, atoms):
+        """Same as ``update_property`` for each atom, but pipelined"""
+        replies = []
+        for atom in atoms:
+            name = self.xcore.atom[atom].name
+            if is_eager(name):
+                replies.append((name,
+                                self.xcore.get_property_async(self, atom)))
+            else:
+                self.props.defer(name, atom)
+        for name, reply in replies:
+            try:
+                self._set_property(name, *reply.get())
+            except XError:
+                log.debug("Error getting property for window %r", self)
+        self.property_changed.emit()
+        self.any_window_changed.emit()
+
+    def fetch_property(self, atom):
+        """Fetches lazy property when it's accessed first time"""
         try:
             self._set_property(self.xcore.atom[atom].name,
                   *self.xcore.get_property(self, atom))
@@ -291,55 +330,27 @@ class Window(BaseWindow):
                                  for p in value
                                  if p not in self.ignore_protocols)
         if name in self.lprops.long_to_short:
-            if isinstance(value, tuple) and len(value) == 1:
+            if isinstance(value, array.array) and len(value) == 1:
                 value = value[0]
             super(LayoutProperties, self.lprops).__setattr__(
                 self.lprops.long_to_short[name], value)
         elif name.startswith('_TN_LP_'):
-            if isinstance(value, tuple) and len(value) == 1:
+            if isinstance(value, array.array) and len(value) == 1:
                 value = value[0]
             super(LayoutProperties, self.lprops).__setattr__(
                 name[len('_TN_LP_'):].lower(), value)
         elif name == '_NET_WM_ICON':
-            icons = self.icons = []
-            lst = list(value)
-            def cvt(px):
-                a = px >> 24
-                k = a / 255.0
-                r = (px >> 16) & 0xff
-                g = (px >> 8) & 0xff
-                b = px & 0xff
-                return (a<<24) | (int(r*k)<<16) | (int(g*k)<<8) | int(b*k)
-            while lst:
-                w = lst.pop(0)
-                h = lst.pop(0)
-                if len(lst) < w*h:
-                    log.warning("Invalid icon %dx%d but but got %d pixels",
-                                w, h, len(lst))
-                    break
-                idata = [cvt(px) for px in lst[:w*h]]
-                del lst[:w*h]
-                icons.append((w, h, idata))
-            icons.sort()
+            self._icons = icon_set(value or ())
+            value = self._icons.data  # shared by windows with equal icons
         self.props[name] = value
-        self.property_changed.emit()
-        self.any_window_changed.emit()
+
+    @property
+    def icons(self):
+        self.props.get('_NET_WM_ICON')  # fetched on first access
+        return self._icons
 
     def draw_icon(self, canvas, x, y, size):
-        for iw, ih, data in self.icons:
-            if iw >= size or ih >= size:
-                break
-        scale = min(iw/size, ih/size)
-        data = array.array('I', data)
-        assert data.itemsize == 4
-        surf = cairo.ImageSurface.create_for_data(memoryview(data),
-            cairo.FORMAT_ARGB32, iw, ih, iw*4)
-        pat = cairo.SurfacePattern(surf)
-        pat.set_matrix(cairo.Matrix(
-            xx=scale, yy=scale,
-            x0=-x*scale, y0=-y*scale))
-        pat.set_filter(cairo.FILTER_BEST)
-        canvas.set_source(pat)
+        canvas.set_source_surface(self.icon_cache.get(self.icons, size), x, y)
         canvas.rectangle(x, y, size, size)
         canvas.fill()
 
@@ -464,6 +475,27 @@ class Window(BaseWindow):
                 pass  # TODO(tailhook) implement me
 
 
+def prefetch_properties(windows, *names):
+    """Fetches lazy properties of all the windows in a single round trip
+
+    Should be called before reading the properties of many windows in a row,
+    otherwise each one is fetched with its own round trip on access
+    """
+    replies = []
+    for win in windows:
+        for name in names:
+            entry = win.props.pending.get(name)
+            if entry is not None:
+                replies.append((win, name, entry,
+                    win.xcore.get_property_async(win, entry.atom)))
+    for win, name, entry, reply in replies:
+        try:
+            win._set_property(name, *reply.get())
+        except XError:
+            log.debug("Error getting property for window %r", win)
+        win.props.fetched(name, entry)
+
+
 class DisplayWindow(Window):
 
     def __init__(self, wid, expose_handler, focus_in=None, focus_out=None):
@@ -487,17 +519,14 @@ class DisplayWindow(Window):
 @has_dependencies
 class HintWindow(Window):
 
-    cairo = None
+    _img = None
 
     theme = dependency(Theme, 'theme')
+    render = dependency(RenderScheduler, 'render-scheduler')
 
     def __init__(self, wid, parent):
         super().__init__(wid)
         self.parent = parent
-        self.redraw_ev = Event('hint.redraw')
-        self.redraw_ev.listen(self.do_redraw)
-        self.show_ev = Event('hint.show')
-        self.show_ev.listen(self.do_show)
 
     def __zorro_di_done__(self):
         self.sizer = cairo.Context(
@@ -510,13 +539,6 @@ class HintWindow(Window):
         self.color = self.theme.hint.text_color_pat
         self.background = self.theme.hint.background_pat
 
-        self._gc = self.xcore._conn.new_xid()  # TODO(tialhook) private api?
-        self.xcore.raw.CreateGC(
-            cid=self._gc,
-            drawable=self.xcore.root_window,
-            params={},
-            )
-
     def set_text(self, text):
         self.text = text
         lines = text.split('\n')
@@ -530,24 +552,26 @@ class HintWindow(Window):
         h += self.padding.top + self.padding.bottom
         w = int(w)
         h = int(h)
-        need_resize = (self.cairo is None or
-                w != self.cairo.get_target().get_width() and
-                h != self.cairo.get_target().get_height)
+        need_resize = (self._img is None or
+                w != self._img.width or h != self._img.height)
         if need_resize:
-            self.cairo = cairo.Context(cairo.ImageSurface(
-                cairo.FORMAT_ARGB32, w, h))
+            if self._img is not None:
+                self._img.release()
+            self._img = self.xcore.pixbuf(w, h)
+            self.cairo = self._img.context()
             self.font.apply(self.cairo)
             psz = self.parent.done.size
             self.set_bounds(Rectangle(
                 (psz.width - w)//2 - self.border_width,
                 (psz.height - h)//2 - self.border_width,
                 w, h))
-        self.redraw_ev.emit()
+        self.render.dirty(self.do_redraw)
 
     def do_redraw(self):
-        tgt = self.cairo.get_target()
-        w = tgt.get_width()
-        h = tgt.get_height()
+        if self._img is None:  # destroyed
+            return
+        w = self._img.width
+        h = self._img.height
         self.cairo.set_source(self.background)
         self.cairo.rectangle(0, 0, w, h)
         self.cairo.fill()
@@ -558,27 +582,20 @@ class HintWindow(Window):
             self.cairo.move_to((w - tw)//2, y)
             self.cairo.show_text(line)
             y += th
-        self.show_ev.emit()
+        self.do_show()
 
     def expose(self, rect):
-        self.show_ev.emit()
-
-    def do_show(self):
-        tgt = self.cairo.get_target()
-        w = tgt.get_width()
-        h = tgt.get_height()
-        self.xcore.raw.PutImage(
-            format=self.xcore.ImageFormat.ZPixmap,
-            drawable=self,
-            gc=self._gc,
-            width=w,
-            height=h,
-            dst_x=0,
-            dst_y=0,
-            left_pad=0,
-            depth=24,
-            data=bytes(tgt),
-            )
+        self.do_show(rect)
+
+    def do_show(self, rect=None):
+        if self._img is not None:
+            self._img.draw(self, rect=rect)
+
+    def destroy(self):
+        super().destroy()
+        if self._img is not None:
+            self._img.release()
+            self._img = None
 
 
 class ClientMessageWindow(Window):
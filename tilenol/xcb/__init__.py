@@ -1,4 +1,4 @@
 from .xmlparse import Proto
-from .proto import Connection, XError
+from .proto import Connection, XError, Reply, gather
 from .core import Core, Rectangle
 from .keysymparse import Keysyms
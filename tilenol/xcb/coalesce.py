@@ -0,0 +1,160 @@
+"""Queue of received events which folds superseded ones
+
+When events come faster than they are handled (i.e. when dragging a window
+or when application updates its title in a loop) most of them are useless
+by the time they are dispatched. The queue folds them as they are received:
+
+MotionNotify
+    consecutive motion events of the same window replace each other
+
+PropertyNotify
+    new event is dropped if the event for the same window and property
+    is still in the queue, since property value is fetched when the
+    event is handled anyway
+
+Expose
+    a series of expose events of a window is merged into a single
+    event covering all the rectangles, which is queued when ``count``
+    reaches zero
+
+Also events are dispatched by priority class: input events first, then
+window management, and exposes last. The order is kept within the class.
+Events which create, map, unmap or destroy windows (``BARRIERS``) are never
+reordered: everything received before is dispatched before them, and
+nothing received after is dispatched earlier. So button press isn't handled
+before the window is known, and expose isn't handled after the window is
+destroyed.
+"""
+from collections import deque, Counter
+
+
+# Priority classes
+INPUT = 0  # reaction on keyboard and mouse
+WM = 1  # window management
+COSMETIC = 2  # redrawing things, deferred while there is input pending
+
+
+class EventQueue(object):
+
+    PRIORITIES = {
+        'KeyPressEvent': INPUT,
+        'KeyReleaseEvent': INPUT,
+        'ButtonPressEvent': INPUT,
+        'ButtonReleaseEvent': INPUT,
+        'MotionNotifyEvent': INPUT,
+        'EnterNotifyEvent': INPUT,
+        'LeaveNotifyEvent': INPUT,
+        'FocusInEvent': INPUT,
+        'FocusOutEvent': INPUT,
+        'ExposeEvent': COSMETIC,
+        'GraphicsExposureEvent': COSMETIC,
+        'NoExposureEvent': COSMETIC,
+        }
+    BARRIERS = frozenset([
+        'CreateNotifyEvent',
+        'MapRequestEvent',
+        'MapNotifyEvent',
+        'UnmapNotifyEvent',
+        'ReparentNotifyEvent',
+        'DestroyNotifyEvent',
+        ])
+    FOLDERS = {
+        'MotionNotify': '_fold_motion',
+        'PropertyNotify': '_fold_property',
+        'Expose': '_fold_expose',
+        }
+
+    def __init__(self, rules=FOLDERS):
+        # Events between barriers, every segment is a queue per priority
+        # class and the barrier which ends the segment
+        self._queues = deque(), deque(), deque(), deque()
+        self._segments = deque([self._queues])
+        self._properties = set()
+        self._exposes = {}
+        self.folded = Counter()
+        self.set_rules(rules)
+
+    def set_rules(self, names):
+        """Sets names of events to fold (see ``FOLDERS``)"""
+        folders = {}
+        for name in names:
+            if name not in self.FOLDERS:
+                raise ValueError("Can't fold {!r} events, only {}".format(
+                    name, ', '.join(sorted(self.FOLDERS))))
+            folders[name + 'Event'] = getattr(self, self.FOLDERS[name])
+        self._folders = folders
+
+    def __len__(self):
+        return sum(len(queue) for queues in self._segments
+                              for queue in queues)
+
+    def input_pending(self):
+        return any(queues[INPUT] for queues in self._segments)
+
+    def append(self, ev):
+        name = ev.__class__.__name__
+        if name in self.BARRIERS:
+            self._queues[-1].append(ev)
+            self._queues = deque(), deque(), deque(), deque()
+            self._segments.append(self._queues)
+            return
+        fold = self._folders.get(name)
+        if fold is None or not fold(ev):
+            self._queues[self.PRIORITIES.get(name, WM)].append(ev)
+
+    def popleft(self):
+        while True:
+            for queue in self._segments[0]:
+                if queue:
+                    ev = queue.popleft()
+                    break
+            else:
+                if len(self._segments) > 1:
+                    self._segments.popleft()
+                    continue
+                raise IndexError("pop from an empty queue")
+            break
+        if self._properties and ev.__class__.__name__ == 'PropertyNotifyEvent':
+            self._properties.discard((ev.window, ev.atom))
+        return ev
+
+    def _fold_motion(self, ev):
+        queue = self._queues[INPUT]
+        if queue:
+            last = queue[-1]
+            if(last.__class__ is ev.__class__ and last.event == ev.event
+               and last.state == ev.state):
+                queue[-1] = ev
+                self.folded['MotionNotify'] += 1
+                return True
+        return False
+
+    def _fold_property(self, ev):
+        key = ev.window, ev.atom
+        if key in self._properties:
+            self.folded['PropertyNotify'] += 1
+            return True
+        self._properties.add(key)
+        return False
+
+    def _fold_expose(self, ev):
+        old = self._exposes.pop(ev.window, None)
+        if old is None:
+            if ev.count == 0:
+                return False
+            x1, y1 = ev.x, ev.y
+            x2, y2 = ev.x + ev.width, ev.y + ev.height
+        else:
+            x1, y1, x2, y2 = old
+            x1 = min(x1, ev.x)
+            y1 = min(y1, ev.y)
+            x2 = max(x2, ev.x + ev.width)
+            y2 = max(y2, ev.y + ev.height)
+            self.folded['Expose'] += 1
+        if ev.count:
+            self._exposes[ev.window] = x1, y1, x2, y2
+        else:
+            self._queues[COSMETIC].append(ev.__class__(ev.seq,
+                window=ev.window, x=x1, y=y1, width=x2 - x1, height=y2 - y1,
+                count=0))
+        return True
@@ -0,0 +1,298 @@
+"""Compiles protocol structures into specialized codecs
+
+Walking ``Struct.items`` for every packet costs a ``struct.unpack_from`` and
+a ``hasattr`` check per field. Instead each structure is turned into a
+python function (once, on first use). Runs of fixed-size fields are packed
+and unpacked by a single precompiled ``struct.Struct``, and the result is
+built by a single dict display. Events are not decoded at all until a field
+is accessed, see ``LazyEvent``.
+"""
+import array
+import struct
+import keyword
+
+
+def is_fixed(field):
+    return isinstance(getattr(field, 'typ', None), str)
+
+
+def fixed_format(items):
+    """Returns struct format of items if all of them are fixed-size"""
+    if all(map(is_fixed, items.values())):
+        return '<' + ''.join(f.typ for f in items.values())
+
+
+def array_typecode(char):
+    """Returns array typecode of same size and signedness as struct char"""
+    size = struct.calcsize('<' + char)
+    for code in ('bhilq' if char.islower() else 'BHILQ'):
+        if array.array(code).itemsize == size:
+            return code
+
+
+def split_runs(items):
+    """Yields runs of fixed-size fields and single variable-size ones
+
+    Each run is yielded as a ``(fixed, [(name, field), ...])`` tuple
+    """
+    run = []
+    for name, field in items.items():
+        if is_fixed(field):
+            run.append((name, field))
+            continue
+        if run:
+            yield True, run
+            run = []
+        yield False, [(name, field)]
+    if run:
+        yield True, run
+
+
+def _build(name, lines, namespace):
+    src = '\n'.join(lines)
+    code = compile(src, '<xcb codec {}>'.format(name), 'exec')
+    exec(code, namespace)
+    return namespace['codec']
+
+
+def compile_reader(name, items):
+    """Returns ``read_from(buf, pos)`` for a structure
+
+    The function returns a ``(dict, pos)`` tuple
+    """
+    namespace = {}
+    lines = ['def codec(buf, pos=0):']
+    fields = []
+    for idx, (fixed, run) in enumerate(split_runs(items)):
+        if fixed:
+            st = struct.Struct('<' + ''.join(f.typ for _, f in run))
+            names = []
+            for fname, field in run:
+                if not field.typ.endswith('x'):
+                    var = '_v{:d}'.format(len(fields))
+                    fields.append((fname, var))
+                    names.append(var)
+            if names:
+                namespace['_s{:d}'.format(idx)] = st
+                lines.append('    {}, = _s{:d}.unpack_from(buf, pos)'
+                             .format(', '.join(names), idx))
+            lines.append('    pos += {:d}'.format(st.size))
+        else:
+            (fname, field), = run
+            namespace['_f{:d}'.format(idx)] = field
+            var = '_v{:d}'.format(len(fields))
+            length = getattr(field, 'length', None)
+            known = dict(fields)
+            if length and all(n in known or n == 'length'
+                              for n in length.refs):
+                # length is calculated from local variables
+                namespace['_l{:d}'.format(idx)] = length.function
+                lines.append('    {}, pos = _f{:d}.read_items(buf, pos, '
+                             '_l{:d}({}))'.format(var, idx, idx, ', '.join(
+                                known.get(n, '(len(buf) - pos)//4')
+                                for n in length.refs)))
+            elif hasattr(field, 'rich_read_from'):
+                context = ', '.join('{!r}: {}'.format(n, v) for n, v in fields)
+                lines.append('    {}, pos = _f{:d}.rich_read_from('
+                             'buf, pos, {{{}}})'.format(var, idx, context))
+            else:
+                lines.append('    {}, pos = _f{:d}.read_from(buf, pos)'
+                             .format(var, idx))
+            fields.append((fname, var))
+    lines.append('    return {{{}}}, pos'.format(', '.join(
+        '{!r}: {}'.format(n, v) for n, v in fields)))
+    return _build(name, lines, namespace)
+
+
+def compile_writer(name, items, explain):
+    """Returns ``write_to(buf, value)`` for a structure
+
+    The ``explain(value)`` is called when packing fails, it's expected to
+    raise a more descriptive exception than ``struct.error``
+    """
+    namespace = {'struct': struct, '_explain': explain}
+    lines = ['def codec(buf, value):']
+    for idx, (fname, field) in enumerate(items.items()):
+        if hasattr(field, 'add_data'):
+            namespace['_p{:d}'.format(idx)] = field
+            lines.append('    _p{:d}.add_data(value)'.format(idx))
+    lines.append('    try:')
+    lines.append('        pass')
+    for idx, (fixed, run) in enumerate(split_runs(items)):
+        if fixed:
+            namespace['_s{:d}'.format(idx)] = struct.Struct(
+                '<' + ''.join(f.typ for _, f in run))
+            lines.append('        buf += _s{:d}.pack({})'.format(idx,
+                ', '.join('value[{!r}]'.format(fname)
+                          for fname, field in run
+                          if not field.typ.endswith('x'))))
+        else:
+            (fname, field), = run
+            namespace['_f{:d}'.format(idx)] = field
+            if isinstance(fname, int):
+                lines.append('        _f{:d}.write_to(buf, None)'.format(idx))
+            else:
+                lines.append('        _f{:d}.write_to(buf, value[{!r}])'
+                             .format(idx, fname))
+    lines.append('    except struct.error:')
+    lines.append('        _explain(value)')
+    lines.append('        raise')
+    return _build(name, lines, namespace)
+
+
+class LazyEvent(object):
+    """Base of event types, fields are decoded from the packet on access
+
+    The packet is a 32-byte event as received from the wire (including
+    the sequence number). Subclasses are generated by ``compile_event_type``
+    """
+    __slots__ = ('seq', '_buf')
+    _event = None
+    _fields = ()
+    _names = {}
+
+    def __init__(self, seq, *args, **kwargs):
+        """Creates an event from field values rather than from a packet"""
+        kwargs.update(zip(self._fields, args))
+        event = self._event
+        buf = bytearray([event.number])
+        event.write_to(buf, {self._names[k]: v for k, v in kwargs.items()})
+        if not event.no_seq:
+            buf[2:2] = struct.pack('<H', (seq or 0) & 0xFFFF)
+        buf += bytes(32 - len(buf))
+        self.seq = seq
+        self._buf = buf
+
+    @property
+    def code(self):
+        """Event code as sent by server (without the "synthetic" bit)"""
+        return self._buf[0] & 127
+
+    @classmethod
+    def from_packet(cls, seq, buf):
+        self = cls.__new__(cls)
+        self.seq = seq
+        self._buf = buf
+        return self
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={!r}'.format(name, getattr(self, name))
+            for name in ('seq',) + self._fields))
+
+
+def _fixed_property(char, offset):
+    if char == 'B':
+        return property(lambda self: self._buf[offset])
+    unpack_from = struct.Struct('<' + char).unpack_from
+    return property(lambda self: unpack_from(self._buf, offset)[0])
+
+
+def _tail_property(offset):
+    return property(lambda self: bytes(self._buf[offset:32]))
+
+
+def _decoded_property(name):
+    def getter(self):
+        buf = self._buf
+        if not self._event.no_seq:
+            buf = buf[:2] + buf[4:]
+        return self._event.read_from(buf, 1)[0][name]
+    return property(getter)
+
+
+def _event_offset(event, pos):
+    """Offset in the packet of the field at ``pos`` of the description"""
+    if event.no_seq or pos < 2:
+        return pos
+    return pos + 2
+
+
+def compile_event_type(event):
+    """Returns a ``LazyEvent`` subclass for the ``Event`` description
+
+    Every fixed-size field is a property which unpacks the value at its
+    offset in the packet. The rare variable-size field (i.e. data of the
+    ClientMessage) is returned as bytes up to the end of the packet.
+    """
+    namespace = {'__slots__': (), '_event': event}
+    fields = []
+    names = {}
+    items = list(event.items.items())
+    pos = 1  # None when the rest of the offsets are unknown
+    for idx, (name, field) in enumerate(items):
+        if pos is None:
+            if is_fixed(field) and field.typ.endswith('x'):
+                continue
+            prop = _decoded_property(name)
+        elif is_fixed(field):
+            offset = _event_offset(event, pos)
+            size = struct.calcsize('<' + field.typ)
+            pos += size
+            if field.typ.endswith('x'):
+                continue
+            if not event.no_seq and offset < 2 < offset + size:
+                prop = _decoded_property(name)  # crosses sequence number
+            else:
+                prop = _fixed_property(field.typ, offset)
+        elif idx == len(items) - 1:
+            prop = _tail_property(_event_offset(event, pos))
+        else:
+            prop = _decoded_property(name)
+            pos = None
+        attr = name + '_' if keyword.iskeyword(name) else name
+        namespace[attr] = prop
+        names[attr] = name
+        fields.append(attr)
+    namespace['_fields'] = tuple(fields)
+    namespace['_names'] = names
+    return type(event.name + 'Event', (LazyEvent,), namespace)
+
+
+class OutBuffer(bytearray):
+    """Serialized request which keeps large payloads by reference
+
+    Payloads of at least ``PAYLOAD_MIN`` bytes (i.e. image data) are not
+    copied into the buffer but kept as separate segments, so the request
+    may be written to the socket by a single ``sendmsg``. This means that
+    the payload must not be changed until the request is sent, so callers
+    pass immutable objects (i.e. ``bytes``) or memory which isn't reused
+    until the server is done with the request.
+    """
+    PAYLOAD_MIN = 4096
+
+    def __init__(self):
+        super().__init__()
+        self.payloads = []
+        self.payload_size = 0
+        self.fds = []
+
+    def add_payload(self, value):
+        value = memoryview(value).cast('B')
+        if len(value) < self.PAYLOAD_MIN:
+            self.extend(value)
+        else:
+            self.payloads.append((len(self), value))
+            self.payload_size += len(value)
+
+    def add_fd(self, fd):
+        self.fds.append(fd)
+
+    @property
+    def size(self):
+        return len(self) + self.payload_size
+
+    def segments(self, start=0):
+        """Returns list of buffers with the data starting at ``start``"""
+        view = memoryview(self)
+        result = []
+        for offset, payload in self.payloads:
+            result.append(view[start:offset])
+            result.append(payload)
+            start = offset
+        result.append(view[start:])
+        return result
+
+
+class Fds(list):
+    """File descriptors to pass along with the segments of a request"""
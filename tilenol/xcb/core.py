@@ -1,33 +1,36 @@
+import sys
+import array
+import logging
 from functools import partial
 from collections import namedtuple, defaultdict
-import struct
 
 from zorro.util import cached_property
 
 try:
-    from .shm import ShmPixbuf
+    from .shm import ShmPool, SYSV_SHM, MEMFD
 except ImportError:
+    ShmPool = None
     import warnings
     warnings.warn('Shm is not available, expect poor performance.')
 
 try:
     from .pixbuf import Pixbuf
+    from .xrender import Renderer
 except ImportError:
+    Renderer = None
     import warnings
     warnings.warn('Cairo is not available, no drawing would work')
 
 
-fmtlen = {
-    0: 0,
-    8: 1,
-    16: 2,
-    32: 4,
-    }
+# array typecodes of property formats, items are native-endian
 fmtchar = {
     8: 'B',
     16: 'H',
-    32: 'L',
+    32: 'I',
     }
+assert all(array.array(c).itemsize*8 == f for f, c in fmtchar.items())
+
+log = logging.getLogger(__name__)
 
 
 class Rectangle(namedtuple('_Rectangle', 'x y width height')):
@@ -91,19 +94,35 @@ class EnumWrapper(object):
 
 
 class RawWrapper(object):
+    """Calls requests by name, i.e. ``raw.GetGeometry(drawable=wid)``
+
+    Same requests via ``raw.async_`` attribute do not wait for reply, but
+    return ``Reply`` object instead.
+    """
 
-    def __init__(self, conn, proto, opcode=None):
+    def __init__(self, conn, proto, opcode=None, async_=False):
         self._conn = conn
         self._proto = proto
         self._opcode = opcode
+        if async_:
+            self._request = conn.do_request_async
+        else:
+            self._request = conn.do_request
+            self.async_ = RawWrapper(conn, proto, opcode, async_=True)
 
     def __getattr__(self, name):
-        return partial(self._conn.do_request,
+        return partial(self._request,
             self._proto.requests[name], _opcode=self._opcode)
 
 
 class Core(object):
 
+    # GetProperty lengths, in 4-byte units. The first request is enough for
+    # most properties, the rest of the big ones is read in chunks
+    property_head = 1024
+    property_chunk = 16384
+    max_property_bytes = 4 << 20
+
     def __init__(self, connection):
         self._conn = connection
         self._conn.connection()
@@ -122,16 +141,54 @@ class Core(object):
             setattr(self, k, rw)
             for ename, lst in v.enums.items():
                 setattr(rw, ename, EnumWrapper(lst))
+        if hasattr(self, 'bigreq'):
+            self._conn.enable_big_requests(
+                self.bigreq.Enable()['maximum_request_length'])
         self.root = self._conn.init_data['roots'][0]
         self.root_window = self.root['root']
         pad = self._conn.init_data['bitmap_format_scanline_pad']
         assert pad % 8 == 0
         self.bitmap_stride = pad//8
+        self.shm_pool = None
+        if hasattr(self, 'shm') and ShmPool is not None:
+            memfd = self._shm_passes_fds()
+            if memfd or SYSV_SHM:
+                self.shm_pool = ShmPool(self, memfd=memfd)
         self.current_event = None
         self.last_event = None
         self.last_time = 0
         self._event_iterator = self._events()
 
+    def _shm_passes_fds(self):
+        if not MEMFD or not self._conn.connection().unixsock:
+            return False
+        if 'AttachFd' not in self.shm._proto.requests:
+            return False  # xcb-proto is too old
+        ver = self.shm.QueryVersion()
+        return (ver['major_version'], ver['minor_version']) >= (1, 2)
+
+    def event_types(self):
+        """Returns dict of event code to the event description"""
+        return dict(self._conn._eventreg)
+
+    def new_xid(self):
+        return self._conn.new_xid()
+
+    def free_xid(self, xid):
+        self._conn.free_xid(xid)
+
+    @property
+    def max_request_bytes(self):
+        return self._conn.max_request_length*4
+
+    def batch(self):
+        """Context manager which sends all requests issued in it at once
+
+        Use it for bunch of requests without reply (i.e. when configuring
+        many windows), the batch is flushed early on request with reply.
+        """
+        return self._conn.batch()
+
     def init_keymap(self):
         self.keycode_to_keysym = {}
         self.shift_keycode_to_keysym = {}
@@ -141,12 +198,13 @@ class Core(object):
             first_keycode=idata['min_keycode'],
             count=idata['max_keycode'] - idata['min_keycode'],
             )
-        mapiter = iter(mapping['keysyms'])
-        for row in zip(range(idata['min_keycode'], idata['max_keycode']),
-                *(mapiter for i in range(mapping['keysyms_per_keycode']))):
-            self.keycode_to_keysym[row[0]] = row[1]
-            self.shift_keycode_to_keysym[row[0]] = row[2]
-            self.keysym_to_keycode[row[1]].append(row[0])
+        keysyms = mapping['keysyms']
+        step = mapping['keysyms_per_keycode']
+        keycodes = range(idata['min_keycode'], idata['max_keycode'])
+        self.keycode_to_keysym.update(zip(keycodes, keysyms[0::step]))
+        self.shift_keycode_to_keysym.update(zip(keycodes, keysyms[1::step]))
+        for code, sym in self.keycode_to_keysym.items():
+            self.keysym_to_keycode[sym].append(code)
 
         caps = self.ModMask.Lock  # caps lock
         num = getattr(self.ModMask, '2')  # mod2 is usually numlock
@@ -161,7 +219,7 @@ class Core(object):
             params=params)
 
     def create_window(self, bounds, border=0, klass=None, parent=0, params={}):
-        wid = self._conn.new_xid()
+        wid = self.new_xid()
         root = self.root
         self.raw.CreateWindow(**{
             'wid': wid,
@@ -194,22 +252,69 @@ class Core(object):
 
 
     def get_property(self, win, name):
-        result = self.raw.GetProperty(
+        return self.get_property_async(win, name).get()
+
+    def get_property_async(self, win, name):
+        return self._get_property_part(win, name, 0, self.property_head
+            ).then(partial(self._decode_property, win, name))
+
+    def _get_property_part(self, win, name, offset, length, async_=True):
+        raw = self.raw.async_ if async_ else self.raw
+        return raw.GetProperty(
                 delete=False,
                 window=win,
                 property=name,
                 type=self.atom.Any,
-                long_offset=0,
-                long_length=65536)
+                long_offset=offset,
+                long_length=length)
+
+    def _property_parts(self, win, name, first):
+        """Yields value of the first reply, then reads the rest in chunks
+
+        Only ``max_property_bytes`` of the value are read, the rest is
+        dropped to not let clients make us allocate unbounded memory
+        """
+        value = first['value']
+        total = len(value) + first['bytes_after']
+        if total > self.max_property_bytes:
+            log.warning("Property %s of window %d is %d bytes, "
+                "reading only the first %d", self.atom[name].name, win,
+                total, self.max_property_bytes)
+            total = self.max_property_bytes // 4 * 4
+            value = value[:total]
+        yield value
+        size = len(value)
+        left = total - size
+        while left > 0:
+            part = self._get_property_part(win, name, size // 4,
+                min(self.property_chunk, (left + 3) // 4), async_=False)
+            if(part['type'] != first['type']
+               or part['format'] != first['format']):
+                # will be read again on PropertyNotify
+                log.debug("Property %s of window %d changed while reading",
+                    self.atom[name].name, win)
+                break
+            value = part['value'][:left]
+            if not value:
+                break
+            yield value
+            size += len(value)
+            left = min(left - len(value), part['bytes_after'])
+
+    def _decode_property(self, win, name, result):
         typ = self.atom[result['type']]
         if result['format'] == 0:
             return typ, None
-        elif typ in (self.atom.STRING, self.atom.UTF8_STRING):
-            return typ, result['value'].decode('utf-8', 'replace')
-        return typ, struct.unpack('<{}{}'.format(
-            len(result['value']) // fmtlen[result['format']],
-            fmtchar[result['format']]),
-            result['value'])
+        parts = self._property_parts(win, name, result)
+        if typ in (self.atom.STRING, self.atom.UTF8_STRING):
+            return typ, b''.join(parts).decode('utf-8', 'replace')
+        # kept as array, so big properties don't turn into tuples of ints
+        value = array.array(fmtchar[result['format']])
+        for part in parts:
+            value.frombytes(part)
+        if sys.byteorder == 'big':
+            value.byteswap()  # connection is little-endian
+        return typ, value
 
     def _events(self):
         for i in self._conn.get_events():
@@ -226,16 +331,41 @@ class Core(object):
         return self._event_iterator
 
     def pixbuf(self, width, height):
+        """Returns image to draw on, ``release()`` it when not needed"""
         if width*height < 1024:
             return Pixbuf(width, height, self)
-        elif hasattr(self, 'shm') and ShmPixbuf:
-            return ShmPixbuf(width, height, self)
-        elif hasattr(self, 'bigreq') or width*height*4 < 260000:
+        elif self.shm_pool is not None:
+            return self.shm_pool.pixbuf(width, height)
+        else:
             return Pixbuf(width, height, self)
 
+    @cached_property
+    def renderer(self):
+        """Server-side drawing, None if there is no RENDER extension"""
+        if hasattr(self, 'render') and Renderer is not None:
+            try:
+                return Renderer(self)
+            except RuntimeError as e:
+                log.warning("Can't draw with RENDER: %s", e)
+
+    def create_pixmap(self, width, height):
+        pid = self.new_xid()
+        self.raw.CreatePixmap(
+            depth=self.root['root_depth'],
+            pid=pid,
+            drawable=self.root_window,
+            width=width,
+            height=height,
+            )
+        return pid
+
+    def free_pixmap(self, pid):
+        self.raw.FreePixmap(pixmap=pid)
+        self.free_xid(pid)
+
     @cached_property
     def pixbuf_gc(self):
-        res = self._conn.new_xid()
+        res = self.new_xid()
         self.raw.CreateGC(
             cid=res,
             drawable=self.root_window,
@@ -13,24 +13,66 @@ class PixbufBase(object):
     def context(self):
         return self._context
 
+    def release(self):
+        """Frees resources of the pixbuf, it can't be used afterwards"""
 
-class Pixbuf(object):
+    def _bounds(self, rect):
+        """Returns x, y, width, height of the part of image to upload"""
+        if rect is None:
+            return 0, 0, self.width, self.height
+        x = max(int(rect.x), 0)
+        y = max(int(rect.y), 0)
+        return (x, y,
+                min(int(rect.x + rect.width), self.width) - x,
+                min(int(rect.y + rect.height), self.height) - y)
+
+
+class Pixbuf(PixbufBase):
+    """Image uploaded by core PutImage requests (when shm is unavailable)"""
+
+    REQUEST_HEADER = 28  # PutImage fields, and extended length
 
     def __init__(self, width, height, xcore):
         # TODO(tailhook) round up to a scanline
         super().__init__(cairo.ImageSurface(
-            cairo.FORMAT_ARGB32, width, height))
-
-    def draw(self, target, x=0, y=0):
-        self.xcore.raw.PutImage(
-            format=self.xcore.ImageFormat.ZPixmap,
-            drawable=target,
-            gc=self.xcore.pixbuf_gc,
-            width=self._image.get_width(),
-            height=self._image.get_height(),
-            dst_x=x,
-            dst_y=y,
-            left_pad=0,
-            depth=24,
-            data=self._image,
-            )
+            cairo.FORMAT_ARGB32, width, height), xcore)
+
+    def _rows(self, x, y, w, h):
+        """Returns copy of pixels of the rectangle, row after row
+
+        Request keeps large data by reference until it's sent, and the
+        image may be drawn on again before that, so data is always copied
+        """
+        stride = self._image.get_stride()
+        data = self._image.get_data()
+        if x == 0 and w*4 == stride:
+            return bytes(data[y*stride:(y+h)*stride])
+        start = y*stride + x*4
+        return b''.join(data[off:off + w*4]
+                        for off in range(start, start + h*stride, stride))
+
+    def draw(self, target, x=0, y=0, rect=None):
+        """Uploads image (or the ``rect`` of it) at ``x``, ``y`` of target
+
+        Image is split into horizontal bands if it doesn't fit a request
+        """
+        sx, sy, w, h = self._bounds(rect)
+        if w <= 0 or h <= 0:
+            return
+        self._image.flush()
+        band = max((self.xcore.max_request_bytes - self.REQUEST_HEADER)
+                   // (w*4), 1)
+        for by in range(sy, sy + h, band):
+            bh = min(band, sy + h - by)
+            self.xcore.raw.PutImage(
+                format=self.xcore.ImageFormat.ZPixmap,
+                drawable=target,
+                gc=self.xcore.pixbuf_gc,
+                width=w,
+                height=bh,
+                dst_x=x + sx,
+                dst_y=y + by,
+                left_pad=0,
+                depth=24,
+                data=self._rows(sx, by, w, bh),
+                )
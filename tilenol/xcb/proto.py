@@ -1,18 +1,25 @@
+import os
 import os.path
+import sys
 import socket
 import re
 import errno
+import array
 import struct
 import traceback
 import logging
 from math import ceil
 from functools import partial
-from collections import namedtuple, deque
+from itertools import islice
+from contextlib import contextmanager
+from collections import namedtuple, deque, OrderedDict
 
 from zorro import channel, Lock, gethub, Condition, Future
 from zorro.util import setcloexec
 
 from .auth import read_auth
+from .codec import OutBuffer, Fds
+from .coalesce import EventQueue
 
 
 log = logging.getLogger(__name__)
@@ -28,20 +35,86 @@ class XError(Exception):
         return '{}{!r}'.format(self.typ.name, self.params)
 
 
+class Reply(object):
+    """Reply of the request which is sent but may be not received yet"""
+
+    def __init__(self, future, convert=None):
+        self._future = future
+        self._convert = convert
+
+    def get(self):
+        """Waits for the reply, raises XError if request failed"""
+        res = self._future.get()
+        if isinstance(res, XError):
+            raise res
+        if self._convert is not None:
+            res = self._convert(res)
+        return res
+
+    def ready(self):
+        """Returns True if the reply is received, so ``get()`` won't block"""
+        return not self._future.check()
+
+    def then(self, fun):
+        """Returns reply which value is converted by ``fun``"""
+        if self._convert is None:
+            return Reply(self._future, fun)
+        convert = self._convert
+        return Reply(self._future, lambda value: fun(convert(value)))
+
+
+def gather(replies):
+    """Waits for all the replies and returns list of their values
+
+    Raises the first XError occured. Since requests are already sent,
+    it takes a single round trip, for any number of replies.
+    """
+    return [r.get() for r in replies]
+
+
+def format_provenance(prov):
+    """Formats which request failed and where it was sent from
+
+    ``prov`` is recorded by ``Channel.push``
+    """
+    name, major, minor, tb = prov
+    lst = ['Request {} (major opcode {}, minor {})\n'
+           .format(name or '?', major, minor)]
+    if isinstance(tb, tuple):
+        code, lineno = tb
+        tb = [traceback.FrameSummary(code.co_filename, lineno, code.co_name)]
+    if tb:
+        lst.extend(traceback.format_list(tb))
+    return lst
+
+
 class Channel(channel.PipelinedReqChannel):
     MAJOR_VERSION = 11
     MINOR_VERSION = 0
-    BUFSIZE = 4096
+    BUFSIZE = 65536
+    IOV_MAX = 1024
+    PROVENANCE_MODES = ('off', 'sampled', 'full')
 
     def __init__(self, *, host=None, port=None,
-                 unixsock, event_dispatcher, proto):
+                 unixsock, event_dispatcher, proto,
+                 error_provenance='sampled'):
         super().__init__()
+        # Besides the opcode of the request, what to record to find out
+        # which request failed, when error arrives:
+        # * off -- nothing
+        # * sampled -- code object and line of the caller outside of xcb
+        # * full -- the stack of up to five frames (slow)
+        self.error_provenance = error_provenance
         self.unixsock = unixsock
         self.request_id = 0
         self.last_seq = 0
+        # the last request which the server has answered
+        self.replied_id = 0
         self.epoch = 0
         self.event_dispatcher = event_dispatcher
         self.proto = proto
+        self._corked = 0
+        self._flush = False
         self.errors = proto.subprotos['xproto'].errors_by_num.copy()
         if unixsock:
             self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
@@ -75,34 +148,82 @@ class Channel(channel.PipelinedReqChannel):
         buf.extend(auth_type)
         buf.extend(b'\x00'*(4 - len(auth_type) % 4))
         buf.extend(auth_key)
-        return self.request(buf, None).get()
+        return self.request([buf], None).get()
 
     def request(self, input, reply):
+        """Queues request, ``input`` is a list of buffers to send"""
         if not self._alive:
             raise channel.PipeError()
         val = Future()
         self._pending.append((input, val, reply))
+        self._flush = True  # no use to delay requests if we wait for reply
         self._cond.notify()
         return val
 
-    def push(self, input, ignore_error=False):
+    def push(self, input, ignore_error=False, name=None):
         """For requests which do not need an answer"""
+        mode = self.error_provenance
         if ignore_error:
-            tb = None
+            prov = None
         else:
-            tb = traceback.extract_stack(limit=7)[:-2]
-        self._pending.append((input, None, tb))
-
-        self._cond.notify()
+            if mode == 'sampled':
+                frame = sys._getframe(1)
+                while(frame.f_back is not None and frame.f_globals.get(
+                        '__name__', '').startswith(__package__)):
+                    frame = frame.f_back
+                tb = (frame.f_code, frame.f_lineno)
+            elif mode == 'full':
+                tb = traceback.extract_stack(limit=7)[:-2]
+            else:
+                tb = None
+            header = input[0]
+            prov = (name, header[0], header[1], tb)
+        self._pending.append((input, None, prov))
+        if not self._corked:
+            self._cond.notify()
+
+    def cork(self):
+        """Delays sending requests without reply until ``uncork()``
+
+        Calls may be nested, requests are sent on the outermost ``uncork()``
+        or when any request which needs reply is issued.
+        """
+        self._corked += 1
+
+    def uncork(self):
+        self._corked -= 1
+        if not self._corked and self._pending:
+            self._flush = True
+            self._cond.notify()
+
+    def wait_requests(self):
+        while not self._pending or (self._corked and not self._flush):
+            if not self._alive:
+                raise channel.ShutdownException()
+            self._cond.wait()
 
     def sender(self):
-        buf = bytearray()
-
-        add_chunk = buf.extend
+        fds = []
+        try:
+            self._send(fds)
+        finally:
+            # descriptors are owned by the connection since the request
+            # is queued, so they are closed even if they were not sent
+            for inp, _, _ in self._pending:
+                if isinstance(inp[-1], Fds):
+                    fds.extend(inp[-1])
+            for fd in fds:
+                os.close(fd)
+
+    def _send(self, fds):
+        segments = deque()
+
+        add_chunks = segments.extend
         wait_write = gethub().do_write
+        sendmsg = self._sock.sendmsg
 
         while True:
-            if not buf:
+            if not segments:
                 self.wait_requests()
             if not self._alive:
                 return
@@ -110,9 +231,19 @@ class Channel(channel.PipelinedReqChannel):
             for inp, fut, tb in self.get_pending_requests():
                 self._producing.append((self.request_id, fut, tb))
                 self.request_id += 1
-                add_chunk(inp)
+                if isinstance(inp[-1], Fds):
+                    # may be sent with any bytes up to the request itself
+                    fds.extend(inp[-1])
+                    inp = inp[:-1]
+                add_chunks(inp)
+            self._flush = False
+            if fds:
+                anc = [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                        array.array('i', fds))]
+            else:
+                anc = ()
             try:
-                bytes = self._sock.send(buf)
+                bytes = sendmsg(list(islice(segments, self.IOV_MAX)), anc)
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     continue
@@ -120,7 +251,14 @@ class Channel(channel.PipelinedReqChannel):
                     raise
             if not bytes:
                 raise EOFError()
-            del buf[:bytes]
+            if fds:
+                for fd in fds:
+                    os.close(fd)
+                del fds[:]
+            while segments and bytes >= len(segments[0]):
+                bytes -= len(segments.popleft())
+            if bytes:
+                segments[0] = memoryview(segments[0])[bytes:]
 
     def produce(self, seq, value):
         if not self._alive:
@@ -130,6 +268,7 @@ class Channel(channel.PipelinedReqChannel):
         self.last_seq = seq
         seq += self.epoch
         assert seq <= self.request_id
+        self.replied_id = seq
         request_id, fut, reply = self._producing.popleft()
         while request_id < seq:
             if fut is not None:
@@ -144,13 +283,13 @@ class Channel(channel.PipelinedReqChannel):
                 if reply is not None:
                     value = self.parse_reply(reply, value)
             fut.set(value)
-        elif reply:  # traceback here, if reply is None error should be ignored
+        elif reply is not None:  # provenance, if None error is ignored
             if value[0] != 0:
                 log.error("Unmatched reply or mistakenly matched event"
                     " packet: {!r}, data: {!r} \n", value[:32], reply)
                 return
             err = self.parse_error(value)
-            lst = traceback.format_list(reply)
+            lst = format_provenance(reply)
             lst.extend(traceback.format_exception_only(
                 err.__class__, err))
             log.error("Error in asynchronous request\n%s", ''.join(lst))
@@ -181,73 +320,80 @@ class Channel(channel.PipelinedReqChannel):
 
 
     def receiver(self):
-        buf = bytearray()
+        buf = bytearray(self.BUFSIZE)
+        view = memoryview(buf)
+        start = end = 0  # unparsed data is buf[start:end]
+        need = 8  # bytes at start needed to parse the next packet
+        setup = True
 
         sock = self._sock
         wait_read = gethub().do_read
-        add_chunk = buf.extend
-        pos = 0
+        unpack_from = struct.unpack_from
 
         while True:
+            if start == end:
+                start = end = 0
+            elif start + need > len(buf):
+                # move the incomplete packet to the front
+                size = end - start
+                if need > len(buf):
+                    view.release()
+                    old, buf = buf, bytearray(max(need, len(buf)*2))
+                    buf[:size] = old[start:end]
+                    view = memoryview(buf)
+                else:
+                    buf[:size] = buf[start:end]
+                start, end = 0, size
             wait_read(sock)
             try:
-                bytes = sock.recv(self.BUFSIZE)
-                if not bytes:
-                    raise EOFError()
-                add_chunk(bytes)
+                nbytes = sock.recv_into(view[end:])
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     continue
                 else:
                     raise
-            if len(buf)-pos >= 8:
-                res, maj, min, ln = struct.unpack_from('<BxHHH', buf, pos)
-                ln = ln*4+8
-                if len(buf)-pos < ln:
-                    continue
-                self._producing.popleft()[1].set(buf[pos:pos+ln])
-                pos += ln
-                break
+            if not nbytes:
+                raise EOFError()
+            end += nbytes
 
-        while True:
-            if pos*2 > len(buf):
-                del buf[:pos]
-                pos = 0
-            wait_read(sock)
-            try:
-                bytes = sock.recv(self.BUFSIZE)
-                if not bytes:
-                    raise EOFError()
-                add_chunk(bytes)
-            except socket.error as e:
-                if e.errno in (errno.EAGAIN, errno.EINTR):
-                    continue
+            # parse everything we have got so far in one batch
+            while end - start >= need:
+                if setup:
+                    ln = unpack_from('<6xH', buf, start)[0]*4 + 8
                 else:
-                    raise
-            while len(buf)-pos >= 8:
-                opcode, seq, ln = struct.unpack_from('<BxHL', buf, pos)
-                if opcode != 1:
-                    if len(buf) - pos < 32:
-                        break
-                    val = buf[pos:pos+2] + buf[pos+4:pos+32]
-                    pos += 32
-                    if opcode > 1:
-                        self.event_dispatcher(seq, buf[pos-32:pos])
-                        continue
+                    opcode, seq, ln = unpack_from('<BxHL', buf, start)
+                    ln = ln*4 + 32 if opcode == 1 else 32
+                if end - start < ln:
+                    need = ln
+                    break
+                pos = start
+                start += ln
+                need = 8
+                # Each packet is copied once, out of the receive buffer.
+                # Events wait in the queue and replies wait for the
+                # requesting greenlet, so they outlive the buffer, which
+                # is overwritten by the next recv_into. Replies are joined
+                # without sequence number and length in the same copy.
+                if setup:
+                    setup = False
+                    self._producing.popleft()[1].set(bytes(view[pos:start]))
+                elif opcode > 1:
+                    self.event_dispatcher(seq, bytes(view[pos:start]))
+                elif opcode == 1:
+                    self.produce(seq, b''.join((view[pos:pos+2],
+                                               view[pos+8:start])))
                 else:
-                    ln = ln*4+32
-                    if len(buf)-pos < ln:
-                        break
-                    val = buf[pos:pos+2] + buf[pos+8:pos+ln]
-                    pos += ln
-                self.produce(seq, val)
+                    self.produce(seq, b''.join((view[pos:pos+2],
+                                               view[pos+4:start])))
 
 
 class Connection(object):
 
     def __init__(self, proto, display=None,
-        auth_file=None, auth_type=None, auth_key=None):
+        auth_file=None, auth_type=None, auth_key=None,
+        error_provenance='sampled'):
         self.proto = proto
+        self.error_provenance = error_provenance
         if display is None:
             display = os.environ.get('DISPLAY', ':0')
         if auth_file is None and auth_type is None:
@@ -283,7 +429,7 @@ class Connection(object):
         self._channel = None
         self._channel_lock = Lock()
         self._condition = Condition()
-        self.events = deque()
+        self.events = EventQueue()
 
     def connection(self):
         if self._channel is None:
@@ -291,7 +437,8 @@ class Connection(object):
                 if self._channel is None:
                     chan = Channel(unixsock=self.unixsock,
                                    proto=self.proto,
-                                   event_dispatcher=self.event_dispatcher)
+                                   event_dispatcher=self.event_dispatcher,
+                                   error_provenance=self.error_provenance)
                     data = chan.connect(self.auth_type, self.auth_key)
                     core = self.proto.subprotos['xproto']
                     value, pos = core.types['Setup'].read_from(data)
@@ -310,6 +457,20 @@ class Connection(object):
         mask = self.init_data["resource_id_mask"]
         inc = mask & -mask
         self.xid_generator = iter(range(base, base | mask, inc))
+        self.xid_base = base
+        self.xid_mask = mask
+        self.free_xids = set()
+        # XIDs freed, by the last request sent before the free
+        self._released_xids = OrderedDict()
+        # in 4-byte units, raised by ``enable_big_requests``
+        self.max_request_length = d['maximum_request_length']
+
+    def enable_big_requests(self, max_length):
+        """Allows requests up to ``max_length`` units long
+
+        Should be called with the value returned by ``bigreq.Enable``
+        """
+        self.max_request_length = max_length
 
     def query_extension(self, name):
         sub = self.proto.subprotos[name]
@@ -326,24 +487,7 @@ class Connection(object):
 
     def do_request(self, rtype, *, _opcode=None, _ignore_error=False, **kw):
         conn = self.connection()
-        for i in list(kw):
-            n = i + '_len'
-            if n in rtype.items and n not in kw:
-                kw[n] = len(kw[i])
-
-        buf = bytearray()
-        rtype.write_to(buf, kw)
-        if _opcode is None:
-            buf.insert(0, rtype.opcode)
-            if len(buf) < 2:
-                buf.append(0)
-        else:
-            buf.insert(0, _opcode)
-            buf.insert(1, rtype.opcode)
-        ln = int(ceil((len(buf)+2)/4))
-        buf[2:2] = struct.pack('<H', ln)
-        buf += b'\x00'*(ln*4 - len(buf))
-
+        buf = self._serialize(rtype, _opcode, kw)
         if rtype.reply:
             res = conn.request(buf, rtype.reply).get()
             if isinstance(res, XError):
@@ -351,10 +495,135 @@ class Connection(object):
             else:
                 return res
         else:
-            conn.push(buf, ignore_error=_ignore_error)
+            conn.push(buf, ignore_error=_ignore_error, name=rtype.name)
+
+    def do_request_async(self, rtype, *, _opcode=None, **kw):
+        """Sends request and returns ``Reply`` without waiting for it
+
+        Useful to send many requests and then wait for all the replies
+        at once, which takes single round trip instead of one per request.
+        Requests which have no reply are just sent and None is returned.
+        """
+        conn = self.connection()
+        buf = self._serialize(rtype, _opcode, kw)
+        if rtype.reply:
+            return Reply(conn.request(buf, rtype.reply))
+        else:
+            conn.push(buf, name=rtype.name)
+
+    def _serialize(self, rtype, opcode, kw):
+        for i in list(kw):
+            n = i + '_len'
+            if n in rtype.items and n not in kw:
+                kw[n] = len(kw[i])
+
+        body = OutBuffer()
+        rtype.write_to(body, kw)
+        if opcode is None:
+            # first byte of the body is the second byte of the header
+            size = max(body.size, 1) + 3
+            ln = (size + 3) // 4
+            opcode, minor = rtype.opcode, body[0] if body else 0
+            start = 1
+        else:
+            size = body.size + 4
+            ln = (size + 3) // 4
+            minor = rtype.opcode
+            start = 0
+        if ln <= 0xFFFF:
+            header = struct.pack('<BBH', opcode, minor, ln)
+        elif ln + 1 <= self.max_request_length:
+            # BIG-REQUESTS: zero length followed by the 32-bit one
+            header = struct.pack('<BBHL', opcode, minor, 0, ln + 1)
+        else:
+            raise ValueError("Request {} is too long ({} of {} units)"
+                .format(rtype.name, ln, self.max_request_length))
+        body.extend(bytes(ln*4 - size))
+        buf = [header]
+        buf.extend(body.segments(start))
+        if body.fds:
+            buf.append(Fds(body.fds))
+        return buf
+
+    @contextmanager
+    def batch(self):
+        """Requests without reply issued in the block are sent at once"""
+        conn = self.connection()
+        conn.cork()
+        try:
+            yield
+        finally:
+            conn.uncork()
+
+    def set_error_provenance(self, mode):
+        """Sets what is recorded about requests (see ``Channel``)
+
+        The mode is kept by the connection, so it's also used when the
+        channel is created again
+        """
+        if mode not in Channel.PROVENANCE_MODES:
+            raise ValueError("Error provenance mode must be one of {}"
+                .format(', '.join(Channel.PROVENANCE_MODES)))
+        self.error_provenance = mode
+        if self._channel is not None:
+            self._channel.error_provenance = mode
 
     def new_xid(self):
-        return next(self.xid_generator)
+        if self._released_xids:
+            self._recycle_xids()
+        if self.free_xids:
+            return self.free_xids.pop()
+        try:
+            return next(self.xid_generator)
+        except StopIteration:
+            self.xid_generator = self._fetch_xid_range()
+            return next(self.xid_generator)
+
+    def free_xid(self, xid):
+        """Returns XID of the destroyed resource to be reused
+
+        It must only be called when the server has already been asked to
+        free the resource, i.e. on DestroyNotify for windows. The XID isn't
+        reused until the server answers a request sent after this call and
+        all the events received before are handled, so no queued event
+        refers to the new resource by mistake. Freeing the XID again (for
+        another copy of the event) only postpones the reuse. XIDs of other
+        clients are ignored.
+        """
+        if xid & ~self.xid_mask != self.xid_base or xid in self.free_xids:
+            return
+        self._released_xids.pop(xid, None)
+        self._released_xids[xid] = self.connection().request_id
+
+    def _recycle_xids(self):
+        if self.events:
+            return
+        replied = self.connection().replied_id
+        released = self._released_xids
+        while released:
+            xid, request_id = next(iter(released.items()))
+            if request_id > replied:
+                break
+            del released[xid]
+            self.free_xids.add(xid)
+
+    def _fetch_xid_range(self):
+        sub = self.proto.subprotos.get('xc_misc')
+        if sub is None:
+            raise RuntimeError("XIDs exhausted and XC-MISC is not loaded")
+        if not hasattr(self, '_xc_misc_opcode'):
+            ext = self.query_extension('xc_misc')
+            if not ext['present']:
+                raise RuntimeError("XIDs exhausted and XC-MISC is absent")
+            self._xc_misc_opcode = ext['major_opcode']
+        res = self.do_request(sub.requests['GetXIDRange'],
+                              _opcode=self._xc_misc_opcode)
+        if not res['count']:
+            raise RuntimeError("XIDs exhausted")
+        inc = self.xid_mask & -self.xid_mask
+        log.info("Got %d more XIDs from the server", res['count'])
+        return iter(range(res['start_id'],
+                          res['start_id'] + res['count']*inc, inc))
 
     def register_event(self, code, subpro):
         for ev in subpro.events.values():
@@ -364,11 +633,7 @@ class Connection(object):
         etype = self._eventreg[buf[0] & 127]
         if etype.no_seq:
             seq = None
-        else:
-            buf = buf[:2] + buf[4:]
-        ev, pos = etype.read_from(buf, 1)
-        assert pos <= 32
-        self.events.append(etype.type(seq, **ev))
+        self.events.append(etype.type.from_packet(seq, buf))
         self._condition.notify()
 
     def get_events(self):
@@ -1,9 +1,18 @@
+import os
+import mmap
+import ctypes
+import logging
+import weakref
+from collections import defaultdict, deque
+
 import cairo
 
-import ctypes
 from .pixbuf import PixbufBase
 
 
+log = logging.getLogger(__name__)
+
+
 IPC_CREAT = 0o1000
 IPC_PRIVATE = 0
 IPC_RMID = 0
@@ -28,49 +37,238 @@ try:
     shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
     shmctl.restype = ctypes.c_int
 except (OSError, AttributeError):
+    rt = None
+
+SYSV_SHM = rt is not None
+MEMFD = hasattr(os, 'memfd_create')
+if not SYSV_SHM and not MEMFD:
     raise ImportError("Shared memory is not supported")
 
 
-class ShmPixbuf(PixbufBase):
+class ShmSegment(object):
+    """SysV shared memory segment attached both by us and by X server"""
 
-    def __init__(self, width, height, conn):
-        # TODO(tailhook) round up to a scanline
-        size = width*height*4
+    def __init__(self, size, xcore):
+        self.size = size
+        self.xcore = xcore
         self.shmid = shmget(IPC_PRIVATE, size, IPC_CREAT|0o777)
         self.addr = shmat(self.shmid, None, 0)
-        super().__init__(cairo.ImageSurface.create_for_data(
-            (ctypes.c_char * size).from_address(self.addr),
-            cairo.FORMAT_ARGB32, width, height, width*4), conn)
-        self.shmseg = conn._conn.new_xid()
-        conn.shm.Attach(
+        self.shmseg = xcore.new_xid()
+        xcore.shm.Attach(
             shmseg=self.shmseg,
             shmid=self.shmid,
             read_only=True,
             )
 
-    def draw(self, target, x=0, y=0):
+    def buffer(self, size):
+        return (ctypes.c_char * size).from_address(self.addr)
+
+    def destroy(self):
+        self.xcore.shm.Detach(shmseg=self.shmseg)
+        self.xcore.free_xid(self.shmseg)
+        shmdt(self.addr)
+        shmctl(self.shmid, IPC_RMID, 0)
+        del self.shmid
+        del self.addr
+
+
+class MemfdSegment(object):
+    """Anonymous memory file mapped by us and passed to X server (shm 1.2)
+
+    Unlike SysV segments it's freed by the kernel when both processes
+    unmap it, even if any of them crashes, and doesn't need IPC permissions
+    """
+
+    def __init__(self, size, xcore):
+        self.size = size
+        self.xcore = xcore
+        fd = os.memfd_create('tilenol-pixbuf', os.MFD_CLOEXEC)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        except:
+            os.close(fd)
+            raise
+        self.shmseg = xcore.new_xid()
+        xcore.shm.AttachFd(  # fd is closed by connection when it's sent
+            shmseg=self.shmseg,
+            shm_fd=fd,
+            read_only=True,
+            )
+
+    def buffer(self, size):
+        return memoryview(self.map)[:size]
+
+    def destroy(self):
+        self.xcore.shm.Detach(shmseg=self.shmseg)
+        self.xcore.free_xid(self.shmseg)
+        # unmapped when surfaces which use it are garbage collected
+        del self.map
+
+
+class ShmPixbuf(PixbufBase):
+
+    _uploaded = False
+
+    def __init__(self, width, height, segment, pool):
+        self.segment = segment
+        self.pool = pool
+        super().__init__(cairo.ImageSurface.create_for_data(
+            segment.buffer(width*height*4),
+            cairo.FORMAT_ARGB32, width, height, width*4), segment.xcore)
+        # no requests may be sent from the garbage collector, so the pool
+        # only queues the segment, and returns it later
+        self._leak = weakref.finalize(self, pool.leak, segment)
+
+    def draw(self, target, x=0, y=0, rect=None):
+        """Uploads image (or the ``rect`` of it) at ``x``, ``y`` of target"""
+        sx, sy, w, h = self._bounds(rect)
+        if w <= 0 or h <= 0:
+            return
+        self._image.flush()
         self.xcore.shm.PutImage(
             drawable=target,
             gc=self.xcore.pixbuf_gc,
-            src_x=0,
-            src_y=0,
-            src_width=self._image.get_width(),
-            src_height=self._image.get_height(),
-            total_width=self._image.get_width(),
-            total_height=self._image.get_height(),
-            dst_x=x,
-            dst_y=y,
+            src_x=sx,
+            src_y=sy,
+            src_width=w,
+            src_height=h,
+            total_width=self.width,
+            total_height=self.height,
+            dst_x=x + sx,
+            dst_y=y + sy,
             depth=24,
             format=self.xcore.ImageFormat.ZPixmap,
             send_event=0,
-            shmseg=self.shmseg,
+            shmseg=self.segment.shmseg,
             offset=0,
             )
+        self._uploaded = True
 
-    def __del__(self):
+    def release(self):
+        if self.segment is None:
+            return
         self._image.finish()
-        shmdt(self.addr)
-        shmctl(self.shmid, IPC_RMID, 0)
-        del self.shmid
-        del self.addr
-        self.xcore.shm.Detach(shmseg=self.shmseg)
+        if self._uploaded:
+            # request is sent after PutImage, so the reply comes when
+            # the server doesn't read the segment any more
+            fence = self.xcore.raw.async_.GetInputFocus()
+        else:
+            fence = None
+        self._leak.detach()
+        self.pool.put(self.segment, fence)
+        self.segment = None
+
+
+class ShmPool(object):
+    """Keeps shared memory segments for reuse by pixbufs
+
+    Segments are bucketed by size rounded up to the power of two. Segments
+    are returned to the pool by ``ShmPixbuf.release()``, idle ones are
+    destroyed when total size of all segments exceeds ``limit``. Segment
+    which was uploaded from is reused only after the server replies to
+    the request sent after the upload, so queued ``PutImage`` doesn't read
+    the next image drawn in the segment. Segments of pixbufs garbage
+    collected without ``release()`` are returned the same way, next time
+    the pool is used.
+
+    Segments are memfd-based if ``memfd`` is true (server must support
+    shm 1.2 and connection must be a unix socket), and SysV otherwise
+    """
+
+    MIN_SEGMENT = 1 << 16
+
+    def __init__(self, xcore, limit=16 << 20, memfd=False):
+        self.xcore = xcore
+        self.limit = limit
+        self.segment_class = MemfdSegment if memfd else ShmSegment
+        self._idle = defaultdict(list)
+        self._busy = deque()  # (fence reply, segment)
+        self._leaked = []  # segments of garbage collected pixbufs
+        self.total_bytes = 0
+        self.idle_bytes = 0
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+        self.leaked = 0  # garbage collected without release()
+
+    def bucket(self, size):
+        return max(self.MIN_SEGMENT, 1 << (size - 1).bit_length())
+
+    def pixbuf(self, width, height):
+        self._collect()
+        size = self.bucket(width*height*4)
+        idle = self._idle.get(size)
+        if idle:
+            segment = idle.pop()
+            self.idle_bytes -= size
+            self.reused += 1
+        else:
+            self._trim(self.limit - size)
+            segment = self.segment_class(size, self.xcore)
+            self.total_bytes += size
+            self.created += 1
+        return ShmPixbuf(width, height, segment, self)
+
+    def put(self, segment, fence=None):
+        """Returns segment to the pool
+
+        If ``fence`` reply is given, segment is not reused until it's
+        received
+        """
+        self.released += 1
+        if fence is None:
+            self._idle[segment.size].append(segment)
+            self.idle_bytes += segment.size
+        else:
+            self._busy.append((fence, segment))
+        self._collect()
+        self._trim(self.limit)
+
+    def leak(self, segment):
+        """Queues segment of the pixbuf garbage collected without release
+
+        Called by finalizer, so doesn't send anything to the server
+        """
+        self.leaked += 1
+        self._leaked.append(segment)
+
+    def _collect(self):
+        while self._leaked:
+            # the segment might have been uploaded from
+            fence = self.xcore.raw.async_.GetInputFocus()
+            self._busy.append((fence, self._leaked.pop()))
+        busy = self._busy
+        while busy and busy[0][0].ready():  # replies come in order
+            _, segment = busy.popleft()
+            self._idle[segment.size].append(segment)
+            self.idle_bytes += segment.size
+
+    def _trim(self, limit):
+        for size in sorted(self._idle, reverse=True):
+            idle = self._idle[size]
+            while idle and self.total_bytes > limit:
+                idle.pop().destroy()
+                self.total_bytes -= size
+                self.idle_bytes -= size
+
+    def clear(self):
+        """Destroys all idle segments"""
+        self._trim(0)
+
+    def stats(self):
+        return {
+            'backend': self.segment_class.__name__,
+            'total_bytes': self.total_bytes,
+            'idle_bytes': self.idle_bytes,
+            'used_bytes': self.total_bytes - self.idle_bytes,
+            'busy': len(self._busy),
+            'created': self.created,
+            'reused': self.reused,
+            'released': self.released,
+            'leaked': self.leaked,
+            }
+
+    def cmd_stats(self):
+        log.info("Shm pixbufs: %s", ', '.join('{}: {}'.format(k, v)
+                 for k, v in sorted(self.stats().items())))
@@ -1,10 +1,25 @@
+import re
+import sys
+import copy
+import array
 import os.path
 import struct
+import pickle
+import hashlib
 import keyword
+import logging
 from math import ceil
 from collections import namedtuple, OrderedDict
 from xml.etree.ElementTree import parse, tostring
 
+from . import codec
+from .codec import compile_reader, compile_writer, is_fixed, fixed_format
+from .codec import array_typecode, compile_event_type, OutBuffer
+from .. import __version__
+
+
+log = logging.getLogger(__name__)
+
 
 class Basic(object):
 
@@ -51,6 +66,8 @@ class Xid(Simple):
 
 class Struct(Basic):
 
+    compiled = ('read_from', 'write_to')
+
     def __init__(self, name, items):
         super().__init__(name)
         self.items = items
@@ -58,21 +75,36 @@ class Struct(Basic):
     def clone(self, name):
         return self.__class__(name, self.items)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # compiled codecs are not picklable, they are compiled again lazily
+        for name in self.compiled:
+            state.pop(name, None)
+        return state
+
+    def set_length(self, name, expr):
+        """Replaces length expression of the list field ``name``
+
+        Compiled codecs capture length functions, so they're dropped and
+        compiled again on next use
+        """
+        field = self.items[name] = copy.copy(self.items[name])
+        field.length = Length(expr)
+        for attr in Struct.compiled:
+            self.__dict__.pop(attr, None)
+
     def read_from(self, buf, pos=0):
-        data = OrderedDict()
-        oldpos = pos
-        for name, field in self.items.items():
-            if hasattr(field, 'rich_read_from'):
-                value, pos = field.rich_read_from(buf, pos, data)
-            else:
-                value, pos = field.read_from(buf, pos)
-            if value is None:
-                continue
-            data[name] = value
-            oldpos=pos
-        return data, pos
+        # The codec is compiled on first use and replaces this method
+        self.read_from = compile_reader(self.name, self.items)
+        return self.read_from(buf, pos)
 
     def write_to(self, buf, value):
+        self.write_to = compile_writer(self.name, self.items,
+                                       self._explain_error)
+        return self.write_to(buf, value)
+
+    def _explain_error(self, value):
+        buf = bytearray()
         for field in self.items.values():
             if hasattr(field, 'add_data'):
                 field.add_data(value)  # hack for valueparam
@@ -88,14 +120,20 @@ class Struct(Basic):
 
 class Event(Struct):
 
+    compiled = Struct.compiled + ('type',)
+
     def __init__(self, name, number, fields, no_seq=False):
         super().__init__(name, fields)
         self.number = number
         self.no_seq = no_seq
-        allfields = ['seq']
-        allfields.extend(f + '_' if keyword.iskeyword(f) else f
-            for f in fields if isinstance(f, str))
-        self.type = namedtuple(self.name + 'Event', allfields)
+        self._make_type()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_type()
+
+    def _make_type(self):
+        self.type = compile_event_type(self)
 
     def clone(self, name, number):
         return self.__class__(name, number, self.items)
@@ -103,17 +141,27 @@ class Event(Struct):
 
 class Request(Struct):
 
+    compiled = Struct.compiled + ('reply_type',)
+
     def __init__(self, name, opcode, reqfields, repfields):
         super().__init__(name, reqfields)
         self.opcode = int(opcode)
         if repfields:
             self.reply = Struct(self.name + 'Reply', repfields)
+        else:
+            self.reply = None
+        self._make_type()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_type()
+
+    def _make_type(self):
+        if self.reply is not None:
             fields = ['seq']
             fields.extend(f + '_' if keyword.iskeyword(f) else f
-                for f in repfields if isinstance(f, str))
+                for f in self.reply.items if isinstance(f, str))
             self.reply_type = namedtuple(self.name + 'Reply', fields)
-        else:
-            self.reply = None
 
     def clone(self, name, opcode):
         return self.__class__(name, opcode, self.items)
@@ -142,46 +190,128 @@ class Union(Basic):
     def read_from(self, buf, pos):
         return buf[pos:], len(buf)
 
+class Length(object):
+    """Length expression of a list compiled into a plain function
+
+    Function accepts values of the referenced fields as positional
+    arguments. The ``length`` name, unless it's a field, means the number
+    of 4-byte units left in the buffer.
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.refs = tuple(OrderedDict.fromkeys(
+            re.findall(r'[A-Za-z_]\w*', expr)))
+        self._compile()
+
+    def _compile(self):
+        self.function = eval(compile('lambda {}: {}'.format(
+            ', '.join(self.refs), self.expr), "XPROTO", "eval"))
+
+    def __getstate__(self):
+        # only the expression is cached, code objects depend on python
+        state = self.__dict__.copy()
+        del state['function']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
+
+    def __call__(self, buf, pos, data):
+        return self.function(*[data[name] if name in data
+                               else (len(buf) - pos)//4
+                               for name in self.refs])
+
+
 class List(object):
 
-    def __init__(self, code, type):
-        self.code = code
+    def __init__(self, length, type):
+        self.length = length
         self.type = type
-
-    def rich_read_from(self, buf, pos, data):
-        assert self.code
-        ln = eval(self.code, {'length': (len(buf) - pos)//4}, data)
+        self._init_reader()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['read_items']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_reader()
+
+    def _init_reader(self):
+        typ = self.type
+        if is_fixed(typ) and not typ.typ.endswith('x'):
+            self.itemsize = struct.calcsize('<' + typ.typ)
+            self.typecode = array_typecode(typ.typ)
+            self.read_items = self._read_array
+        elif hasattr(typ, 'items') and fixed_format(typ.items):
+            self.item_struct = struct.Struct(fixed_format(typ.items))
+            self.item_fields = tuple(name
+                for name, field in typ.items.items()
+                if not field.typ.endswith('x'))
+            self.itemsize = self.item_struct.size
+            self.read_items = self._read_structs
+        else:
+            self.read_items = self._read_each
+
+    def _read_array(self, buf, pos, num):
+        end = pos + num*self.itemsize
+        value = array.array(self.typecode)
+        value.frombytes(memoryview(buf)[pos:end])
+        if sys.byteorder != 'little':
+            value.byteswap()
+        return value, end
+
+    def _read_structs(self, buf, pos, num):
+        end = pos + num*self.itemsize
+        names = self.item_fields
+        return [dict(zip(names, item)) for item in
+                self.item_struct.iter_unpack(memoryview(buf)[pos:end])], end
+
+    def _read_each(self, buf, pos, num):
         res = []
-        for i in range(ln):
+        for i in range(num):
             value, pos = self.type.read_from(buf, pos)
             res.append(value)
         return res, pos
 
+    def rich_read_from(self, buf, pos, data):
+        assert self.length
+        return self.read_items(buf, pos, self.length(buf, pos, data))
+
     def write_to(self, buf, value):
-        assert self.code is None
-        buf.extend(memoryview(value))
+        # value is packed already (i.e. bytes or array)
+        if isinstance(buf, OutBuffer):
+            buf.add_payload(value)
+        else:
+            buf.extend(memoryview(value))
 
 
 class Bytes(object):
 
-    def __init__(self, code):
-        self.code = code
+    def __init__(self, length):
+        self.length = length
+
+    def read_items(self, buf, pos, num):
+        return buf[pos:pos+num], pos+num
 
     def rich_read_from(self, buf, pos, data):
-        assert self.code
-        ln = eval(self.code, {}, data)
-        value = buf[pos:pos+ln]
-        return value, pos+ln
+        assert self.length
+        return self.read_items(buf, pos, self.length(buf, pos, data))
 
     def write_to(self, buf, value):
-        buf += value
+        if isinstance(buf, OutBuffer):
+            buf.add_payload(value)
+        else:
+            buf += value
 
 
 class String(Bytes):
 
-    def rich_read_from(self, buf, pos, data):
-        value, pos = super().rich_read_from(buf, pos, data)
-        return value.decode('utf-8'), pos
+    def read_items(self, buf, pos, num):
+        return buf[pos:pos+num].decode('utf-8'), pos+num
 
     def write_to(self, buf, value):
         if isinstance(value, str):
@@ -189,6 +319,17 @@ class String(Bytes):
         super().write_to(buf, value)
 
 
+class Fd(object):
+    """File descriptor, which is passed out of band (SCM_RIGHTS)
+
+    Descriptor is closed by connection when request is sent
+    """
+
+    def write_to(self, buf, value):
+        if isinstance(buf, OutBuffer):
+            buf.add_fd(value)
+
+
 class Params(object):
 
     def __init__(self, list_name, mask_name):
@@ -211,11 +352,16 @@ class Params(object):
 
 class Proto(object):
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, cache_dir=None):
         if path is None:
             path = self.resolve_path()
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser(
+                os.environ.get('XDG_CACHE_HOME', '~/.cache')), 'tilenol')
         self.path = path
+        self.cache_dir = cache_dir
         self.subprotos = {}
+        self.files = {}
 
     def resolve_path(self):
         dirs = os.environ.get('XDG_DATA_DIRS')
@@ -236,12 +382,76 @@ class Proto(object):
 
     def load_xml(self, name):
         with open(os.path.join(self.path, name + '.xml'), 'rb') as f:
+            self.files[f.name] = os.fstat(f.fileno()).st_mtime
             xml = parse(f)
         self.subprotos[name] = Subprotocol(self, xml)
 
+    def load_cached(self, *names):
+        """Loads several protocols using precompiled cache if it's fresh
+
+        Cache is keyed on the path of protocol files and names requested,
+        and is valid until any of the files (including imported ones) or
+        tilenol itself is changed
+        """
+        fname = os.path.join(self.cache_dir, 'proto-{}.pickle'.format(
+            hashlib.sha1(repr((self.path, names,
+                               sys.implementation.cache_tag)).encode('utf-8'))
+            .hexdigest()))
+        if self._read_cache(fname):
+            return
+        for name in names:
+            if name not in self.subprotos:
+                self.load_xml(name)
+        self._write_cache(fname)
+
+    def _cache_version(self):
+        return (__version__,
+                sys.implementation.cache_tag,
+                os.stat(__file__).st_mtime,
+                os.stat(codec.__file__).st_mtime)
+
+    def _read_cache(self, fname):
+        try:
+            with open(fname, 'rb') as f:
+                data = pickle.load(f)
+            if data['version'] != self._cache_version():
+                return False
+            for path, mtime in data['files'].items():
+                if os.stat(path).st_mtime != mtime:
+                    return False
+        except FileNotFoundError:
+            return False
+        except Exception:
+            log.warning("Can't read protocol cache %r", fname, exc_info=1)
+            return False
+        for sub in data['subprotos'].values():
+            sub.parent = self
+        self.files.update(data['files'])
+        self.subprotos.update(data['subprotos'])
+        return True
+
+    def _write_cache(self, fname):
+        tmpname = fname + '.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmpname, 'wb') as f:
+                pickle.dump({
+                    'version': self._cache_version(),
+                    'files': self.files,
+                    'subprotos': self.subprotos,
+                    }, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, fname)
+        except Exception:
+            log.warning("Can't write protocol cache %r", fname, exc_info=1)
+
 
 class Subprotocol(object):
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['parent']
+        return state
+
     def __init__(self, parent, xml):
         self.parent = parent
         self.types = {}
@@ -301,16 +511,15 @@ class Subprotocol(object):
                     '{}x'.format(field.attrib['bytes']))
             elif field.tag == 'list':
                 if field.find('*') is not None:
-                    expr = self._parse_expr(field.find('*'))
-                    code = compile(expr, "XPROTO", "eval")
+                    length = Length(self._parse_expr(field.find('*')))
                 else:
-                    code = None
+                    length = None
                 if field.attrib['type'] == 'char':
-                    typ = String(code)
+                    typ = String(length)
                 elif field.attrib['type'] == 'void':
-                    typ = Bytes(code)
+                    typ = Bytes(length)
                 else:
-                    typ = List(code, self.get_type(field.attrib['type']))
+                    typ = List(length, self.get_type(field.attrib['type']))
                 items[field.attrib['name']] = typ
             elif field.tag == 'valueparam':
                 name = field.attrib['value-mask-name']
@@ -318,6 +527,8 @@ class Subprotocol(object):
                     items[name] = self.get_type(
                         field.attrib['value-mask-type'])
                 items['params'] = Params(field.attrib['value-list-name'], name)
+            elif field.tag == 'fd':
+                items[field.attrib['name']] = Fd()
             elif field.tag == 'exprfield':
                 pass  # TODO(tailhook) implement exprfield
             elif field.tag == 'reply':
@@ -0,0 +1,234 @@
+"""Drawing on the server side using RENDER extension
+
+Glyphs of each font are rasterized by cairo and uploaded to the server
+once, then text is drawn by sending glyph indices only. Widgets record
+their drawing into a ``DisplayList`` which is replayed to a picture.
+"""
+import struct
+from math import floor, ceil
+
+import cairo
+
+
+OP_SRC = 1
+OP_OVER = 3
+GLYPHS_PER_ITEM = 254
+
+
+def color16(color, alpha=0xffff):
+    """Converts 0xRRGGBB to the COLOR struct"""
+    return {
+        'red': ((color >> 16) & 0xff) * 0x101,
+        'green': ((color >> 8) & 0xff) * 0x101,
+        'blue': (color & 0xff) * 0x101,
+        'alpha': alpha,
+        }
+
+
+def pack_rectangles(rects):
+    return b''.join(struct.pack('<hhHH', int(x), int(y), int(w), int(h))
+                    for x, y, w, h in rects)
+
+
+def glyph_commands(x, y, ids):
+    """Returns glyphcmds of CompositeGlyphs32 drawing glyphs at x, y"""
+    buf = bytearray()
+    for i in range(0, len(ids), GLYPHS_PER_ITEM):
+        chunk = ids[i:i+GLYPHS_PER_ITEM]
+        # first item moves pen from the origin, next ones continue
+        buf += struct.pack('<B3xhh', len(chunk), x, y)
+        buf += struct.pack('<{}L'.format(len(chunk)), *chunk)
+        x = y = 0
+    return buf
+
+
+class GlyphSet(object):
+    """Glyphs of a single font, uploaded to the server on first use"""
+
+    def __init__(self, renderer, font):
+        self.xcore = renderer.xcore
+        self.font = cairo.ScaledFont(cairo.ToyFontFace(font.face),
+            cairo.Matrix(xx=font.size, yy=font.size), cairo.Matrix(),
+            cairo.FontOptions())
+        self.gsid = self.xcore.new_xid()
+        self.xcore.render.CreateGlyphSet(gsid=self.gsid,
+                                         format=renderer.a8_format)
+        self.advances = {}
+
+    def glyphs(self, text):
+        """Returns glyph indices of the text, uploads unknown glyphs"""
+        ids = [g[0] for g in self.font.text_to_glyphs(0, 0, text, False)]
+        missing = [i for i in dict.fromkeys(ids) if i not in self.advances]
+        if missing:
+            self._upload(missing)
+        return ids
+
+    def width(self, ids):
+        return sum(self.advances[i] for i in ids)
+
+    def _upload(self, ids):
+        infos = bytearray()
+        data = bytearray()
+        for idx in ids:
+            ext = self.font.glyph_extents([(idx, 0, 0)])
+            x_bearing, y_bearing, width, height, x_advance, _ = ext
+            x0 = floor(x_bearing)
+            y0 = floor(y_bearing)
+            w = ceil(x_bearing + width) - x0
+            h = ceil(y_bearing + height) - y0
+            if w > 0 and h > 0:
+                surf = cairo.ImageSurface(cairo.FORMAT_A8, w, h)
+                ctx = cairo.Context(surf)
+                ctx.set_scaled_font(self.font)
+                ctx.show_glyphs([(idx, -x0, -y0)])
+                surf.flush()
+                # rows of A8 surfaces are padded to 4 bytes like X wants
+                data += surf.get_data()
+            else:
+                x0 = y0 = w = h = 0
+            adv = int(round(x_advance))
+            infos += struct.pack('<HHhhhh', w, h, -x0, -y0, adv, 0)
+            self.advances[idx] = adv
+        self.xcore.render.AddGlyphs(
+            glyphset=self.gsid,
+            glyphs_len=len(ids),
+            glyphids=struct.pack('<{}L'.format(len(ids)), *ids),
+            glyphs=infos,
+            data=data,
+            )
+
+
+class Renderer(object):
+    """Server-side resources shared by all pictures of the connection"""
+
+    def __init__(self, xcore):
+        self.xcore = xcore
+        reply = xcore.render.QueryPictFormats()
+        self.a8_format = self._find_format(reply['formats'], 8,
+                                           alpha_mask=0xff)
+        # pixmaps are created at the depth of the root window
+        self.root_format = self._visual_format(reply['screens'],
+                                               xcore.root['root_visual'])
+        self._glyphsets = {}
+        self._fills = {}
+
+    def _find_format(self, formats, depth, **masks):
+        for fmt in formats:
+            if fmt['depth'] != depth or fmt['type'] != 1:  # Direct
+                continue
+            if all(fmt['direct'][k] == v for k, v in masks.items()):
+                return fmt['id']
+        raise RuntimeError("No picture format of depth {}".format(depth))
+
+    def _visual_format(self, screens, visual):
+        for screen in screens:
+            for depth in screen['depths']:
+                for vis in depth['visuals']:
+                    if vis['visual'] == visual:
+                        return vis['format']
+        raise RuntimeError("No picture format of visual {}".format(visual))
+
+    def glyphset(self, font):
+        key = font.face, font.size
+        gs = self._glyphsets.get(key)
+        if gs is None:
+            gs = self._glyphsets[key] = GlyphSet(self, font)
+        return gs
+
+    def solid(self, color):
+        """Returns solid fill picture of the color"""
+        pic = self._fills.get(color)
+        if pic is None:
+            pic = self._fills[color] = self.xcore.new_xid()
+            self.xcore.render.CreateSolidFill(picture=pic,
+                                              color=color16(color))
+        return pic
+
+    def create_picture(self, drawable):
+        pic = self.xcore.new_xid()
+        self.xcore.render.CreatePicture(
+            pid=pic,
+            drawable=drawable,
+            format=self.root_format,
+            value_mask=0,
+            params={},
+            )
+        return pic
+
+    def free_picture(self, pic):
+        self.xcore.render.FreePicture(picture=pic)
+        self.xcore.free_xid(pic)
+
+    def clip(self, pic, rect):
+        self.xcore.render.SetPictureClipRectangles(
+            picture=pic,
+            clip_x_origin=0,
+            clip_y_origin=0,
+            rectangles=pack_rectangles([rect]),
+            )
+
+    def fill(self, pic, color, rects):
+        self.xcore.render.FillRectangles(
+            op=OP_SRC,
+            dst=pic,
+            color=color16(color),
+            rects=pack_rectangles(rects),
+            )
+
+    def display_list(self):
+        return DisplayList(self)
+
+
+class DisplayList(object):
+    """Drawing commands of a widget, replayed on the server
+
+    Coordinates are integer, text is positioned by the baseline like in
+    cairo's ``show_text``
+    """
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.commands = []
+
+    def text_width(self, font, text):
+        gs = self.renderer.glyphset(font)
+        return gs.width(gs.glyphs(text))
+
+    def fill(self, color, x, y, width, height):
+        self.commands.append(('fill', color, (x, y, width, height)))
+
+    def frame(self, color, x, y, width, height, line_width=1):
+        """Rectangle outline, the line is inside of the rectangle"""
+        lw = int(ceil(line_width))
+        self.fill(color, x, y, width, lw)
+        self.fill(color, x, y + height - lw, width, lw)
+        self.fill(color, x, y + lw, lw, height - 2*lw)
+        self.fill(color, x + width - lw, y + lw, lw, height - 2*lw)
+
+    def text(self, font, color, x, y, text):
+        """Draws text, returns its width"""
+        gs = self.renderer.glyphset(font)
+        ids = gs.glyphs(text)
+        if ids:
+            self.commands.append(('text', color, gs,
+                                  glyph_commands(int(x), int(y), ids)))
+        return gs.width(ids)
+
+    def replay(self, pic):
+        rnd = self.renderer
+        for cmd in self.commands:
+            if cmd[0] == 'fill':
+                _, color, rect = cmd
+                rnd.fill(pic, color, [rect])
+            else:
+                _, color, gs, glyphcmds = cmd
+                rnd.xcore.render.CompositeGlyphs32(
+                    op=OP_OVER,
+                    src=rnd.solid(color),
+                    dst=pic,
+                    mask_format=0,
+                    glyphset=gs.gsid,
+                    src_x=0,
+                    src_y=0,
+                    glyphcmds=glyphcmds,
+                    )